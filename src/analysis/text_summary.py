@@ -42,8 +42,8 @@ import argparse                   # Version 1.1
 
 from src.data.preprocessing_text import clean_text
 from src.data.preprocessing_text import replace_typical_misspell
+from src.features.embedding_store import load_embedding
 
-from gensim.models import KeyedVectors                  # Version 3.7,1
 import networkx as nx                                   # Version 2.2
 from sklearn.metrics.pairwise import cosine_similarity  # Version 0.20.1
 
@@ -244,15 +244,18 @@ def load_word_embeddings(file_path):
     Parameters
     ----------
     file_path: str
-        The file path to the downloaded embeddings
+        The file path to the downloaded embeddings, or to the directory
+        written by src/features/embedding_store.py which loads in seconds
     Returns
     -------
-    loaded_embedding: gensim.models.keyedvectors.Word2VecKeyedVectors
-        Returns the embeddings loaded as a gensim object
+    loaded_embedding: gensim.models.keyedvectors.Word2VecKeyedVectors or
+        EmbeddingStore
+        Returns the embeddings loaded as a gensim object, or as a memory
+        mapped EmbeddingStore for a directory
 
     """
 
-    loaded_embedding = KeyedVectors.load_word2vec_format(file_path)
+    loaded_embedding = load_embedding(file_path, unicode_errors='strict')
     return loaded_embedding
 
 
@@ -8,6 +8,7 @@ Created on Mon Jun  6 11:24:21 2019
 
 import numpy as np
 import pandas as pd
+from scipy import sparse
 
 from sklearn.feature_extraction.text import CountVectorizer
 
@@ -16,7 +17,57 @@ stopwords = set(STOPWORDS)
 import matplotlib.pyplot as plt
 
 
-def word_frequency(text, max_features=200, min_df=10, ngram_range=(1, 1)):
+def document_term_matrix(text, min_df=10, ngram_range=(1, 1),
+                         stop_words="english"):
+    """
+    Builds one sparse document-term matrix for the corpus, which can be
+    reused for the word frequency of the corpus and of every theme
+
+    Parameters
+    ----------
+    text: list
+        The comments to count the words of
+    min_df: int
+        The minimum number of comments for a word to be added
+    ngram_range: tuple
+        The smallest and largest n-grams to count, (1, 3) counts unigrams
+        through trigrams
+
+    Returns
+    -------
+    term_doc_matrix: scipy sparse matrix
+        The counts with one row per comment and one column per word
+    words: numpy array
+        The word of each column
+
+    """
+
+    vect = CountVectorizer(min_df=min_df,
+                           stop_words=stop_words,
+                           ngram_range=ngram_range)
+    term_doc_matrix = vect.fit_transform(text)
+    words = np.array(sorted(vect.vocabulary_, key=vect.vocabulary_.get))
+
+    return term_doc_matrix, words
+
+
+def top_counts(counts, k):
+    """
+    Returns the indices of the k largest counts, largest first, without
+    sorting all of the counts
+
+    """
+
+    k = min(k, len(counts))
+    if k == 0:
+        return np.array([], dtype=int)
+
+    top = np.argpartition(-counts, k - 1)[:k]
+    return top[np.argsort(-counts[top], kind="stable")]
+
+
+def word_frequency(text, max_features=200, min_df=10, ngram_range=(1, 1),
+                   term_doc_matrix=None, words=None):
     """
     Counts the word frequency in the given text
     
@@ -28,6 +79,8 @@ def word_frequency(text, max_features=200, min_df=10, ngram_range=(1, 1)):
         The max number of features for count vectorizer
     min_df: int
         The minimum frequency for a word to be added
+    term_doc_matrix, words: optional
+        The output of document_term_matrix, so the text is only counted once
     
     Returns
     -------
@@ -35,25 +88,64 @@ def word_frequency(text, max_features=200, min_df=10, ngram_range=(1, 1)):
     
     """
 
-    vect = CountVectorizer(min_df=min_df, 
-                           max_features=max_features, 
-                           stop_words="english",
-                           ngram_range=ngram_range)
-    term_doc_matrix = vect.fit_transform(text)
-    words = vect.get_feature_names()
-
-    word_counts = term_doc_matrix.sum(axis=0)
-    word_count = []
-    for i in word_counts.tolist():
-        for j in i:
-            word_count.append(j) 
+    if term_doc_matrix is None:
+        term_doc_matrix, words = document_term_matrix(text, min_df,
+                                                      ngram_range)
 
-    d = {"words":words, "counts":word_count}
-    word_freq = pd.DataFrame(d)
+    word_counts = np.asarray(term_doc_matrix.sum(axis=0)).ravel()
+    top = top_counts(word_counts, max_features)
 
-    word_freq=word_freq.sort_values(by=["counts"], ascending=False)
+    word_freq = pd.DataFrame({"words": words[top],
+                              "counts": word_counts[top]})
     return word_freq
 
+
+def theme_word_frequency(term_doc_matrix, words, labels, top_k=200):
+    """
+    Counts the word frequency of every theme or subtheme at once by
+    multiplying the document-term matrix by the label matrix
+
+    Parameters
+    ----------
+    term_doc_matrix, words:
+        The output of document_term_matrix
+    labels: dataframe
+        The 0/1 theme or subtheme columns, with one row per comment
+    top_k: int
+        The number of most frequent words to keep for each n-gram length
+
+    Returns
+    -------
+    word_freqs: dict
+        A data frame for each theme with the words, counts and n-gram length
+        of the most frequent words. Words that are not in the theme's
+        comments are left out.
+
+    """
+
+    label_matrix = sparse.csr_matrix(labels.fillna(0).values.T,
+                                     dtype=term_doc_matrix.dtype)
+    theme_counts = (label_matrix @ term_doc_matrix).tocsr()
+    ngrams = np.char.count(words.astype(str), " ") + 1
+
+    word_freqs = {}
+    for i, theme in enumerate(labels.columns):
+        row = theme_counts[i]
+        indices, counts = row.indices, row.data
+
+        top = []
+        for n in np.unique(ngrams[indices]):
+            in_ngram = np.flatnonzero(ngrams[indices] == n)
+            top.append(in_ngram[top_counts(counts[in_ngram], top_k)])
+        top = np.concatenate(top) if top else np.array([], dtype=int)
+
+        word_freqs[theme] = pd.DataFrame({"words": words[indices[top]],
+                                          "counts": counts[top],
+                                          "ngram": ngrams[indices[top]]})
+
+    return word_freqs
+
+
 def generate_WordCloud(text, background_color="white", min_font_size=10, max_words=50, collocations=False,
                       width=800, height=800):
     """
@@ -89,6 +181,145 @@ def generate_WordCloud(text, background_color="white", min_font_size=10, max_wor
 
 
 
+class LengthSummary:
+    """
+    Mergeable summary of the number of words or characters per sentence.
+    The lengths are kept as a histogram, so the min, max, mean and median
+    are exact and summaries of chunks or themes can be added together
+    without reading the sentences again.
+
+    """
+
+    def __init__(self, counts=None):
+        self.counts = np.zeros(0, dtype=np.int64) if counts is None \
+            else np.asarray(counts, dtype=np.int64)
+
+    def update(self, lengths):
+        """Adds an array of lengths to the histogram"""
+
+        lengths = np.asarray(lengths, dtype=np.int64)
+        counts = np.bincount(lengths, minlength=len(self.counts))
+        counts[:len(self.counts)] += self.counts
+        self.counts = counts
+        return self
+
+    def __add__(self, other):
+        size = max(len(self.counts), len(other.counts))
+        counts = np.zeros(size, dtype=np.int64)
+        counts[:len(self.counts)] += self.counts
+        counts[:len(other.counts)] += other.counts
+        return LengthSummary(counts)
+
+    @property
+    def n(self):
+        return int(self.counts.sum())
+
+    @property
+    def min(self):
+        return int(np.flatnonzero(self.counts)[0])
+
+    @property
+    def max(self):
+        return int(np.flatnonzero(self.counts)[-1])
+
+    @property
+    def mean(self):
+        return np.dot(np.arange(len(self.counts)), self.counts) / self.n
+
+    @property
+    def median(self):
+        # The same as np.median, the middle two lengths are averaged
+        cumulative = np.cumsum(self.counts)
+        lower = np.searchsorted(cumulative, (self.n - 1) // 2, side="right")
+        upper = np.searchsorted(cumulative, self.n // 2, side="right")
+        return (lower + upper) / 2
+
+    def hist(self, bins):
+        """Plots the histogram the same as plt.hist on the lengths"""
+
+        plt.hist(np.arange(len(self.counts)), bins, weights=self.counts,
+                 range=(self.min, self.max))
+
+
+def sentence_summaries(sentences):
+    """
+    Summarizes the number of characters and words per sentence with pandas
+    string methods
+
+    Parameters
+    ----------
+    sentences: list or Pandas series object
+        Missing sentences are skipped
+
+    Returns
+    -------
+    summary_char, summary_word: LengthSummary
+
+    """
+
+    sentences = pd.Series(sentences).dropna()
+    summary_char = LengthSummary().update(sentences.str.len())
+    summary_word = LengthSummary().update(sentences.str.split().str.len())
+
+    return summary_char, summary_word
+
+
+def stream_sentence_summaries(chunks, labels=None):
+    """
+    Summarizes sentences read in chunks, for example
+    pd.read_csv(filepath, chunksize=10000), so the corpus never has to fit
+    in memory
+
+    Parameters
+    ----------
+    chunks: iterable of dataframes
+        Data frames with the sentences in the second column
+    labels: list, optional
+        The theme or subtheme columns to also summarize each theme
+
+    Returns
+    -------
+    summaries: dict
+        A (summary_char, summary_word) tuple for "all" and for each label
+
+    """
+
+    summaries = {}
+    for df in chunks:
+        groups = {"all": df.iloc[:, 1]}
+        for label in labels or []:
+            groups[label] = df.iloc[:, 1][df[label] == 1]
+
+        for group, sentences in groups.items():
+            summary = sentence_summaries(sentences)
+            if group in summaries:
+                summary = (summaries[group][0] + summary[0],
+                           summaries[group][1] + summary[1])
+            summaries[group] = summary
+
+    return summaries
+
+
+def summary_stats(summary_char, summary_word):
+    """
+    Returns a dataframe with the min, max, mean and median for the number
+    of words and characters
+
+    """
+
+    labels = ["min", "max", "mean", "median"]
+    values_char = [summary_char.min, summary_char.max, summary_char.mean,
+                   summary_char.median]
+    values_word = [summary_word.min, summary_word.max, summary_word.mean,
+                   summary_word.median]
+    d = {'stats' : labels,
+         'character values': values_char,
+         'word values': values_word}
+    stats_df = pd.DataFrame(data=d).round(2)
+
+    return stats_df
+
+
 def sentence_eda(sentences, word_plot=False, character_plot=False):
     """
     Input list of sentences and get the mean, median, max, min number of words per sentence.
@@ -118,53 +349,22 @@ def sentence_eda(sentences, word_plot=False, character_plot=False):
         characters. 
    
     """
-    # count the number of characters per sentence
-    counts_char = []
-    for chracters in sentences:
-        counts_char.append(len(chracters))
-    minimum_char = min(counts_char)
-    maximum_char = max(counts_char)
-    mean_char = np.mean(counts_char)
-    median_char = np.median(counts_char)
+    summary_char, summary_word = sentence_summaries(sentences)
 
     if character_plot == True:
         fig=plt.figure(figsize=(10, 6))
-        plt.hist(counts_char, 50)
+        summary_char.hist(50)
         plt.title("Number of characters per sentence", fontsize=16)
         plt.xlabel('Number of characters', fontsize=14)
         plt.ylabel('Count', fontsize=14)
         plt.show();
 
-    # count number of words per sentence
-    counts_words = []
-    for words in sentences:
-        counts_words.append(len(words.split()))
-    minimum_word = min(counts_words)
-    maximum_word = max(counts_words)
-    mean_word = np.mean(counts_words)
-    median_word = np.median(counts_words)
-
     if word_plot == True:
          fig=plt.figure(figsize=(10, 6))
-         plt.hist(counts_words, 40)
+         summary_word.hist(40)
          plt.title("Number of words per sentence", fontsize=16)
          plt.xlabel('Number of words', fontsize=14)
          plt.ylabel('Count', fontsize=14)
          plt.show();
 
-    # create lists for the dataframe
-    labels = ["min", "max", "mean", "median"]
-    values_char = [minimum_char, maximum_char, mean_char, median_char]
-    values_word = [minimum_word, maximum_word, mean_word, median_word]
-    # create dataframe
-    d = {'stats' : labels,
-         'character values': values_char,
-         'word values': values_word}
-    stats_df = pd.DataFrame(data=d).round(2)
-
-    return stats_df
-
-
-    
-    
-    
\ No newline at end of file
+    return summary_stats(summary_char, summary_word)
@@ -0,0 +1,223 @@
+# benchmark_preprocessing.py
+# Author: Aaron Quinton
+# Date: 2019-07-02
+
+# This script times the comment preprocessing used for the pretrained
+# embeddings and the bag of words model. The chained .apply implementation is
+# kept here as the reference and every result is checked against it. With
+# --n_jobs it also reports how preprocessing scales across processes. The
+# misspelling replacement is also timed with larger dictionaries. If no
+# input csv is given, synthetic comments are generated from WES-like phrases.
+
+# USAGE:
+'''
+python src/data/benchmark_preprocessing.py \
+--input_csv data/interim/train_2018-qualitative-data.csv \
+--n_comments 100000 \
+--n_jobs 4
+'''
+
+# Import Modules
+import sys
+sys.path.insert(1, '.')
+import re
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from src.data.preprocessing_text import clean_text, clean_numbers
+from src.data.preprocessing_text import replace_typical_misspell
+from src.data.preprocessing_text import remove_stopwords, mispell_dict
+from src.data.preprocessing_text import MisspellingReplacer
+from src.data.preprocessing_text import preprocess_for_embed
+from src.data.preprocessing_text import preprocess_for_bow
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark comment'
+                                     'preprocessing')
+
+    parser.add_argument('--input_csv', '-i', type=str, dest='input_csv',
+                        action='store', default=None,
+                        help='optional input csv file with comments')
+
+    parser.add_argument('--n_comments', '-n', type=int, dest='n_comments',
+                        action='store', default=100000,
+                        help='number of comments to benchmark')
+
+    parser.add_argument('--n_jobs', '-j', type=int, dest='n_jobs',
+                        action='store', default=1,
+                        help='benchmark scaling from 1 up to n_jobs processes')
+
+    args = parser.parse_args()
+    return args
+
+
+phrases = ["My supervisor's behaviour isn't great, he didnt listen!",
+           "Favouritism in the centre; 150 staff & 12,000 clients.",
+           'More "training" / counselling for new hires (2018-2019).',
+           'The organisation cancelled travelling to Victoria #wwii',
+           'Labour practise: I feel valued & respected at work.',
+           'Pay is 20% below market - 3 years without a raise?',
+           'Acknowledgement from Exec would help morale...',
+           'Use Instagram, WhatsApp or Snapchat to share news.']
+
+
+def get_comments(n_comments, input_csv=None, seed=2019):
+    '''Return a series of n_comments comments, either resampled from a csv
+    or generated from the phrases above'''
+
+    if input_csv is not None:
+        comments = pd.read_csv(input_csv).iloc[:, 1].dropna()
+        return comments.sample(n=n_comments, replace=True, random_state=seed)\
+                       .reset_index(drop=True)
+
+    rng = np.random.RandomState(seed)
+    lengths = rng.randint(1, 6, size=n_comments)
+    return pd.Series([' '.join(rng.choice(phrases, size=length))
+                      for length in lengths])
+
+
+def chained_preprocess_for_embed(text, embeddings_index, split=True):
+    '''Reference implementation of preprocess_for_embed using chained
+    .apply calls'''
+
+    text = text.apply(lambda x: clean_text(x)) \
+               .apply(lambda x: replace_typical_misspell(x))
+
+    if embeddings_index in ['glove_wiki', 'w2v_google_news']:
+        text = text.apply(lambda x: clean_numbers(x))
+    if embeddings_index == 'glove_wiki':
+        text = text.apply(lambda x: x.lower())
+
+    if split:
+        text = remove_stopwords(text.str.split())
+    return text
+
+
+def chained_preprocess_for_bow(text):
+    '''Reference implementation of preprocess_for_bow using chained
+    .apply calls'''
+
+    text = text.apply(lambda x: clean_text(x)) \
+               .apply(lambda x: replace_typical_misspell(x)) \
+               .apply(lambda x: x.lower())
+
+    return np.array(text)
+
+
+def time_call(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def benchmark_normalizer(comments):
+    '''Time the chained and fused preprocessing for each profile and check
+    the outputs are identical
+
+    Returns
+    -------
+    results: dataframe with the time in seconds for each path
+    '''
+    results = []
+    for embed in ['glove_wiki', 'w2v_google_news', 'glove_crawl']:
+        for split in [False, True]:
+            expected, chained = time_call(chained_preprocess_for_embed,
+                                          comments, embed, split)
+            actual, fused = time_call(preprocess_for_embed, comments, embed,
+                                      split)
+            assert list(expected) == list(actual), embed
+            results.append([embed, split, chained, fused])
+
+    expected, chained = time_call(chained_preprocess_for_bow, comments)
+    actual, fused = time_call(preprocess_for_bow, comments)
+    assert (expected == actual).all(), 'bow'
+    results.append(['bow', False, chained, fused])
+
+    results = pd.DataFrame(results, columns=['profile', 'split', 'chained_s',
+                                             'fused_s'])
+    results['speedup'] = results.chained_s / results.fused_s
+    return results.round(3)
+
+
+def benchmark_n_jobs(comments, max_jobs, chunksize=10000):
+    '''Time preprocess_for_embed, preprocess_for_bow and remove_stopwords on
+    1 to max_jobs processes and check the outputs match the single process
+    result
+
+    Returns
+    -------
+    results: dataframe with the time in seconds for each number of processes
+    '''
+    tokens = [comment.split() for comment in comments]
+    steps = {'embed': lambda n: preprocess_for_embed(comments, 'glove_wiki',
+                                                     True, None, n,
+                                                     chunksize),
+             'bow': lambda n: list(preprocess_for_bow(comments, None, n,
+                                                      chunksize)),
+             'stopwords': lambda n: remove_stopwords(tokens, n, chunksize)}
+
+    results = []
+    for step, func in steps.items():
+        expected, single = time_call(func, 1)
+        for n_jobs in range(1, max_jobs + 1):
+            actual, seconds = time_call(func, n_jobs)
+            assert expected == actual, (step, n_jobs)
+            results.append([step, n_jobs, seconds, single / seconds])
+
+    return pd.DataFrame(results, columns=['step', 'n_jobs', 'seconds',
+                                          'speedup']).round(3)
+
+
+def benchmark_misspell_dictionary(comments, sizes=(1000, 10000),
+                                  seed=2019):
+    '''Time replacing misspellings with dictionaries padded with random
+    words, using a regex alternation of the whole dictionary and the
+    MisspellingReplacer
+
+    Returns
+    -------
+    results: dataframe with the time in seconds for each dictionary size
+    '''
+    comments = [clean_text(comment) for comment in comments]
+    rng = np.random.RandomState(seed)
+    letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+
+    results = []
+    for size in (len(mispell_dict),) + tuple(sizes):
+        dictionary = dict(mispell_dict)
+        while len(dictionary) < size:
+            word = ''.join(rng.choice(letters, size=rng.randint(4, 12)))
+            dictionary[word] = word.upper()
+
+        pattern = re.compile(r'\b(?:%s)\b' % '|'.join(dictionary))
+
+        def replace(match):
+            return dictionary[match.group(0)]
+
+        _, regex = time_call(lambda: [pattern.sub(replace, comment)
+                                      for comment in comments])
+
+        replacer = MisspellingReplacer(dictionary)
+        _, trie = time_call(lambda: [replacer.replace(comment)
+                                     for comment in comments])
+        results.append([size, regex, trie])
+
+    return pd.DataFrame(results, columns=['dictionary_size', 'regex_s',
+                                          'replacer_s']).round(3)
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    args = get_arguments()
+    comments = get_comments(args.n_comments, args.input_csv)
+
+    print('Benchmarking', len(comments), 'comments')
+    print(benchmark_normalizer(comments).to_string(index=False))
+    print(benchmark_misspell_dictionary(comments[:10000])
+          .to_string(index=False))
+
+    if args.n_jobs > 1:
+        print(benchmark_n_jobs(comments, args.n_jobs).to_string(index=False))
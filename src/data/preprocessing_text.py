@@ -7,9 +7,16 @@
 # https://www.kaggle.com/christofhenkel/how-to-preprocessing-when-using-embeddings
 
 # Import modules
+import os
 import re
+import hashlib
+import sqlite3
 import operator
+from collections import OrderedDict
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+import pandas as pd
 from tqdm import tqdm
 tqdm.pandas()
 
@@ -59,9 +66,90 @@ def clean_numbers(x):
     return x
 
 
-def _get_mispell(mispell_dict):
-    mispell_re = re.compile('(%s)' % '|'.join(mispell_dict.keys()))
-    return mispell_dict, mispell_re
+# Splits text into alternating separators and words, ie. [sep, word, sep, ...]
+_word_split_re = re.compile(r'(\w+)')
+
+
+class MisspellingReplacer:
+    '''Replace whole words, or phrases of whole words separated by
+    whitespace, with their correct spelling.
+
+    The dictionary is compiled into a trie over words. Each word of the text
+    is looked up with one hash lookup, so the run time depends on the length
+    of the text and not the size of the dictionary. When several phrases
+    start at the same word the longest one is replaced.
+
+    Parameters
+    ----------
+    replacements : dict
+        Maps each misspelled word or phrase to its replacement
+    '''
+    def __init__(self, replacements):
+        self.replacements = {}
+        self._trie = {}
+
+        for key, replacement in replacements.items():
+            words = key.split()
+            if not words or not all(_word_split_re.fullmatch(word)
+                                    for word in words):
+                raise ValueError('Misspellings must be words separated by '
+                                 'whitespace: %r' % key)
+
+            # Each node is [replacement or None, {next word: node}]
+            node = [None, self._trie]
+            for word in words:
+                node = node[1].setdefault(word, [None, {}])
+            node[0] = replacement
+            self.replacements[' '.join(words)] = replacement
+
+        self._first_words = frozenset(self._trie)
+        self._phrases = any(node[1] for node in self._trie.values())
+
+    def replace(self, text):
+        '''Replace the misspellings in a string
+
+        Parameters
+        ----------
+        text : str
+
+        Returns
+        -------
+        text : a string with corrected spelling
+        '''
+        # When every whitespace separated token is alphanumeric the tokens are
+        # the words, so most comments are ruled out without the regex split
+        tokens = text.split()
+        if self._first_words.isdisjoint(tokens) and ''.join(tokens).isalnum():
+            return text
+
+        pieces = _word_split_re.split(text)
+        words = pieces[1::2]
+        if self._first_words.isdisjoint(words):
+            return text
+
+        if not self._phrases:
+            pieces[1::2] = [self.replacements.get(word, word)
+                            for word in words]
+            return ''.join(pieces)
+
+        i = 1
+        while i < len(pieces):
+            node = self._trie.get(pieces[i])
+            end = None
+            j = i
+            while node is not None:
+                if node[0] is not None:
+                    end, replacement = j, node[0]
+                if j + 2 >= len(pieces) or not pieces[j + 1].isspace():
+                    break
+                node = node[1].get(pieces[j + 2])
+                j += 2
+
+            if end is not None:
+                pieces[i:end + 1] = [replacement]
+            i += 2
+
+        return ''.join(pieces)
 
 
 mispell_dict = {'colour': 'color',
@@ -92,7 +180,11 @@ mispell_dict = {'colour': 'color',
                 'whatsapp': 'social medium',
                 'snapchat': 'social medium'
                 }
-mispellings, mispellings_re = _get_mispell(mispell_dict)
+mispellings = MisspellingReplacer(mispell_dict)
+
+# Increase whenever the preprocessing rules or mispell_dict change so cached
+# comments from an older version are not reused
+PREPROCESSING_VERSION = 2
 
 
 def replace_typical_misspell(text):
@@ -107,87 +199,416 @@ def replace_typical_misspell(text):
     -------
     x : a string with corrected spelling
     '''
-    def replace(match):
-        return mispellings[match.group(0)]
+    return mispellings.replace(text)
+
 
-    return mispellings_re.sub(replace, text)
+_stopwords = frozenset(['a', 'to', 'of', 'and'])
 
 
-def remove_stopwords(sentences):
+def remove_stopwords(sentences, n_jobs=1, chunksize=10000):
     '''Removes common stopwords from a tokenized list of words
 
     Parameters
     ----------
     x : list of words
+    n_jobs : int
+        Number of processes to split the sentences across, -1 for all cores
+    chunksize : int
+        Number of sentences sent to a process at a time
 
     Returns
     -------
     x : list of words with stop words removed
     '''
-    to_remove = ['a', 'to', 'of', 'and']
+    return map_chunks(_remove_stopwords_chunk, list(sentences), n_jobs,
+                      chunksize)
 
-    sentences_re = [[word for word in sentence if word not in to_remove]
-                    for sentence in sentences]
 
-    return sentences_re
+def _remove_stopwords_chunk(sentences):
+    return [[word for word in sentence if word not in _stopwords]
+            for sentence in sentences]
 
 
-def preprocess_for_embed(text, embeddings_index, split=True):
-    '''Preprocess text data from a dataframe based on the pretrained embedding
+def map_chunks(func, items, n_jobs=1, chunksize=10000):
+    '''Apply a function to consecutive chunks of a list in a process pool and
+    join the results back together in the original order
 
     Parameters
     ----------
-    text : Pandas series object
-    embeddings_index: The name of the pretrained embedding
+    func : picklable function taking a list and returning a list of the same
+           length
+    items : list
+    n_jobs : int
+        Number of processes, -1 for all cores. Runs in this process when 1.
+    chunksize : int
+        Number of items sent to a process at a time
 
     Returns
     -------
-    text : list of tokenized words for each comment
+    results : list
     '''
-    if embeddings_index in ['glove_wiki', 'glove_twitter', 'w2v_base_model']:
-        text = text.apply(lambda x: clean_text(x)) \
-                   .apply(lambda x: replace_typical_misspell(x)) \
-                   .apply(lambda x: clean_numbers(x)) \
-                   .apply(lambda x: x.lower())
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    if n_jobs == 1 or len(items) <= chunksize:
+        return func(items)
 
-        if split:
-            text = remove_stopwords(text.str.split())
-        return text
+    chunks = [items[start:start + chunksize]
+              for start in range(0, len(items), chunksize)]
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        results = pool.map(func, chunks)
+        return [item for chunk in results for item in chunk]
+
+
+###############################################################################
+# Fused normalizer: one compiled object per embedding profile                 #
+###############################################################################
+# Characters handled by clean_text as a single str.translate table. The '&'
+# padding is applied separately as it is the only multi-character rewrite
+_clean_table = str.maketrans("/-'", '   ',
+                             '?!.,"#$%()*+:;<=>@[\\]^_`{|}~' + '“”’')
+
+# Steps applied after clean_text and replace_typical_misspell for each profile
+_profile_steps = {'glove_wiki': {'numbers': True, 'lower': True},
+                  'w2v_google_news': {'numbers': True, 'lower': False},
+                  'crawl': {'numbers': False, 'lower': False},
+                  'bow': {'numbers': False, 'lower': True}}
 
+
+def get_profile(embeddings_index):
+    '''Return the preprocessing profile used for a pretrained embedding
+
+    Parameters
+    ----------
+    embeddings_index : str
+        The name of the pretrained embedding
+
+    Returns
+    -------
+    profile : str
+        One of 'glove_wiki', 'w2v_google_news' or 'crawl'
+    '''
+    if embeddings_index in ['glove_wiki', 'glove_twitter', 'w2v_base_model']:
+        return 'glove_wiki'
     if embeddings_index == 'w2v_google_news':
-        text = text.apply(lambda x: clean_text(x)) \
-                   .apply(lambda x: replace_typical_misspell(x)) \
-                   .apply(lambda x: clean_numbers(x))
+        return 'w2v_google_news'
+    return 'crawl'
 
-        if split:
-            text = remove_stopwords(text.str.split())
-        return text
 
-    else:
-        text = text.apply(lambda x: clean_text(x)) \
-                   .apply(lambda x: replace_typical_misspell(x))
+# clean_numbers in one pass: runs of 2 to 4 digits keep their length and
+# longer runs become #####
+_mask_numbers_re = re.compile('[0-9][0-9]+')
+
+
+def _mask_numbers(match):
+    digits = len(match.group(0))
+    return '#####' if digits >= 5 else '#' * digits
+
+
+class TextNormalizer:
+    '''Compiled equivalent of the chained clean_text, replace_typical_misspell,
+    clean_numbers and lower calls for one preprocessing profile.
+
+    Punctuation is handled with one str.translate table, the misspellings
+    with the shared MisspellingReplacer and the numbers with one regex, so
+    each comment is scanned a fixed number of times instead of once per
+    punctuation mark and pattern. The output is identical to the chained
+    functions.
+
+    Parameters
+    ----------
+    profile : str
+        One of 'glove_wiki', 'w2v_google_news', 'crawl' or 'bow'
+    '''
+    def __init__(self, profile):
+        self.profile = profile
+        steps = _profile_steps[profile]
+        self.numbers = steps['numbers']
+        self.lower = steps['lower']
+
+    def normalize(self, x):
+        '''Normalize a single comment
+
+        Parameters
+        ----------
+        x : str
+
+        Returns
+        -------
+        x : the normalized comment
+        '''
+        x = str(x).translate(_clean_table)
+        if '&' in x:
+            x = x.replace('&', ' & ')
+        x = mispellings.replace(x)
+        if self.numbers:
+            x = _mask_numbers_re.sub(_mask_numbers, x)
+        if self.lower:
+            x = x.lower()
+        return x
+
+    __call__ = normalize
+
+    def remap_token(self, token):
+        '''Map a token from the 'crawl' profile to this profile. The profiles
+        only differ in number masking and lower casing, which never change
+        where a comment splits into words, so tokenizing with 'crawl' and
+        remapping gives the same tokens as tokenizing with this profile.
+
+        Parameters
+        ----------
+        token : str
+            A token produced by the 'crawl' profile
+
+        Returns
+        -------
+        token : str, or None when the token becomes a stopword
+        '''
+        if self.numbers:
+            token = _mask_numbers_re.sub(_mask_numbers, token)
+        if self.lower:
+            token = token.lower()
+        if token in _stopwords:
+            return None
+        return token
+
+    def tokenize(self, x):
+        '''Normalize a single comment and split it into words with
+        stopwords removed
+
+        Parameters
+        ----------
+        x : str
+
+        Returns
+        -------
+        x : list of words
+        '''
+        return _split_words(self.normalize(x))
+
+    def transform(self, text, split=False, cache=None, n_jobs=1,
+                  chunksize=10000):
+        '''Normalize every comment in a series
+
+        Parameters
+        ----------
+        text : Pandas series object
+        split : bool
+            Return a list of tokenized words for each comment instead
+        cache : PreprocessingCache, optional
+            Reuse and store the normalized comments in this cache
+        n_jobs : int
+            Number of processes to split the comments across, -1 for all
+            cores
+        chunksize : int
+            Number of comments sent to a process at a time
+
+        Returns
+        -------
+        text : Pandas series object, or list of tokenized words for each
+               comment when split is True
+        '''
+        if cache is None:
+            normalized = map_chunks(partial(_normalize_chunk, self.profile,
+                                            split),
+                                    list(text), n_jobs, chunksize)
+            if split:
+                return normalized
+        else:
+            normalized = cache.normalize(self, text, n_jobs, chunksize)
 
         if split:
-            text = remove_stopwords(text.str.split())
-        return text
+            return [_split_words(x) for x in normalized]
+        return pd.Series(normalized, index=text.index, name=text.name)
 
 
-def preprocess_for_bow(text):
+def _split_words(x):
+    return [word for word in x.split() if word not in _stopwords]
+
+
+def _normalize_chunk(profile, split, comments):
+    normalizer = get_normalizer(profile)
+    if split:
+        return [normalizer.tokenize(x) for x in comments]
+    return [normalizer.normalize(x) for x in comments]
+
+
+_normalizers = {}
+
+
+def get_normalizer(profile):
+    '''Return the TextNormalizer for a preprocessing profile. Normalizers are
+    compiled once per profile and reused.
+
+    Parameters
+    ----------
+    profile : str
+        One of 'glove_wiki', 'w2v_google_news', 'crawl' or 'bow'
+
+    Returns
+    -------
+    normalizer : TextNormalizer
+    '''
+    if profile not in _normalizers:
+        _normalizers[profile] = TextNormalizer(profile)
+    return _normalizers[profile]
+
+
+###############################################################################
+# Cache of normalized comments, in memory and on disk                         #
+###############################################################################
+class PreprocessingCache:
+    '''Cache of normalized comments keyed by the comment hash, the
+    preprocessing profile and PREPROCESSING_VERSION.
+
+    Recently used comments are kept in an in-process LRU tier. If a filepath
+    is given, every normalized comment is also stored in a small sqlite file
+    so repeat runs and later scripts skip comments that were already
+    processed. Token lists are rebuilt from the cached text with a split.
+
+    Parameters
+    ----------
+    filepath : str, optional
+        The sqlite file for the on-disk tier. Only the in-process tier is
+        used when None.
+    maxsize : int
+        The number of comments kept in the in-process tier
+    '''
+    def __init__(self, filepath=None, maxsize=100000):
+        self.filepath = filepath
+        self.maxsize = maxsize
+        self._lru = OrderedDict()
+        self._db = None
+
+        if filepath is not None:
+            self._db = sqlite3.connect(filepath, timeout=60)
+            self._db.execute('CREATE TABLE IF NOT EXISTS normalized '
+                             '(key BLOB PRIMARY KEY, text TEXT NOT NULL) '
+                             'WITHOUT ROWID')
+
+    @staticmethod
+    def _key(profile, comment):
+        key = '%s\0%s\0%s' % (PREPROCESSING_VERSION, profile, comment)
+        return hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+
+    def _remember(self, key, text):
+        self._lru[key] = text
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+
+    def _read_disk(self, keys, chunksize=500):
+        found = {}
+        for start in range(0, len(keys), chunksize):
+            chunk = keys[start:start + chunksize]
+            query = 'SELECT key, text FROM normalized WHERE key IN (%s)' % \
+                ','.join('?' * len(chunk))
+            found.update(self._db.execute(query, chunk))
+        return found
+
+    def normalize(self, normalizer, comments, n_jobs=1, chunksize=10000):
+        '''Normalize comments with a TextNormalizer, only running it on the
+        comments missing from both tiers
+
+        Parameters
+        ----------
+        normalizer : TextNormalizer
+        comments : iterable of comments
+        n_jobs : int
+            Number of processes used for the missing comments
+        chunksize : int
+            Number of comments sent to a process at a time
+
+        Returns
+        -------
+        normalized : list of normalized comments
+        '''
+        comments = [str(comment) for comment in comments]
+        normalized = [None] * len(comments)
+
+        # Positions of each comment missing from the in-process tier
+        missing = {}
+        for i, comment in enumerate(comments):
+            key = self._key(normalizer.profile, comment)
+            text = self._lru.get(key)
+            if text is None:
+                missing.setdefault(key, []).append(i)
+            else:
+                self._lru.move_to_end(key)
+                normalized[i] = text
+
+        if self._db is not None and missing:
+            for key, text in self._read_disk(list(missing)).items():
+                key = bytes(key)
+                for i in missing.pop(key):
+                    normalized[i] = text
+                self._remember(key, text)
+
+        new_rows = []
+        texts = map_chunks(partial(_normalize_chunk, normalizer.profile,
+                                   False),
+                           [comments[positions[0]]
+                            for positions in missing.values()],
+                           n_jobs, chunksize)
+        for (key, positions), text in zip(missing.items(), texts):
+            for i in positions:
+                normalized[i] = text
+            self._remember(key, text)
+            new_rows.append((key, text))
+
+        if self._db is not None and new_rows:
+            with self._db:
+                self._db.executemany('INSERT OR REPLACE INTO normalized '
+                                     'VALUES (?, ?)', new_rows)
+
+        return normalized
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def preprocess_for_embed(text, embeddings_index, split=True, cache=None,
+                         n_jobs=1, chunksize=10000):
+    '''Preprocess text data from a dataframe based on the pretrained embedding
+
+    Parameters
+    ----------
+    text : Pandas series object
+    embeddings_index: The name of the pretrained embedding
+    cache : PreprocessingCache, optional
+    n_jobs : int
+        Number of processes to split the comments across, -1 for all cores
+    chunksize : int
+        Number of comments sent to a process at a time
+
+    Returns
+    -------
+    text : list of tokenized words for each comment
+    '''
+    normalizer = get_normalizer(get_profile(embeddings_index))
+    return normalizer.transform(text, split, cache, n_jobs, chunksize)
+
+
+def preprocess_for_bow(text, cache=None, n_jobs=1, chunksize=10000):
     '''Preprocess text data for the bag of words model
 
     Parameters
     ----------
     text : Pandas series object
+    cache : PreprocessingCache, optional
+    n_jobs : int
+        Number of processes to split the comments across, -1 for all cores
+    chunksize : int
+        Number of comments sent to a process at a time
 
     Returns
     -------
     text : numpy array
     '''
-    text = text.apply(lambda x: clean_text(x)) \
-               .apply(lambda x: replace_typical_misspell(x)) \
-               .apply(lambda x: x.lower())
-
-    return np.array(text)
+    return np.array(get_normalizer('bow').transform(text, cache=cache,
+                                                    n_jobs=n_jobs,
+                                                    chunksize=chunksize))
 
 
 def balance_themes(X, Y):
@@ -202,26 +623,100 @@ def balance_themes(X, Y):
     -------
     Y : numpy array with comment labels
     '''
+    index = get_balanced_indices(Y)
+
+    return X[index], Y[index]
+
+
+def get_random_state(random_state=None):
+    '''Returns a numpy RandomState
+
+    Parameters
+    ----------
+    random_state : int, numpy RandomState or None
+        None returns the global RandomState behind np.random, so np.random.seed
+        still makes the draws repeatable. A RandomState is returned as is.
+
+    Returns
+    -------
+    rng : numpy RandomState
+    '''
+    if random_state is None:
+        return np.random.mtrand._rand
+    if isinstance(random_state, np.random.RandomState):
+        return random_state
+    return np.random.RandomState(random_state)
+
+
+def get_balanced_indices(Y, random_state=None):
+    '''Returns the row indices that balance a label matrix. Every row is kept
+    once and the rows of each label are resampled with replacement until the
+    label has as many comments as the most common one. Labels without any
+    comments, which happens for some of the 62 subthemes, are skipped.
+
+    Parameters
+    ----------
+    Y : numpy array with comment labels, one column per theme or subtheme
+    random_state : int or numpy RandomState, optional
+
+    Returns
+    -------
+    index : numpy array of row indices into X and Y
+    '''
+    rng = get_random_state(random_state)
+    Y = np.asarray(Y)
     counts = np.sum(Y, axis=0)
 
+    index = [np.arange(Y.shape[0])]
     for i in range(Y.shape[1]):
+        if counts[i] == 0:
+            continue
+        labeled = np.flatnonzero(Y[:, i] == 1)
+        index.append(labeled[rng.randint(low=0, high=counts[i],
+                                         size=max(counts) - counts[i])])
+
+    return np.concatenate(index)
+
+
+def balanced_steps_per_epoch(Y, batch_size=128):
+    '''Returns the number of batches balanced_batches yields per epoch'''
+    counts = np.sum(Y, axis=0)
+    size = Y.shape[0] + np.sum(max(counts) - counts[counts > 0])
+
+    return int(np.ceil(size / batch_size))
 
-        X_labeled = X[Y[:, i] == 1, :]
-        Y_labeled = Y[Y[:, i] == 1, :]
 
-        index = np.random.randint(low=0, high=counts[i],
-                                  size=max(counts) - counts[i])
-        X_array_to_append = X_labeled[index, :]
-        Y_array_to_append = Y_labeled[index, :]
+def balanced_batches(X, Y, batch_size=128, shuffle=True, random_state=None):
+    '''Yields balanced minibatches indefinitely, for Keras fit_generator with
+    steps_per_epoch=balanced_steps_per_epoch(Y, batch_size). Each epoch draws
+    new indices with get_balanced_indices and only the rows of the current
+    batch are copied out of X and Y, so X and Y are never balanced in memory
+    like balance_themes does. conv1d.py and biGRU.py train with it when run
+    with --balance.
 
-        if i == 0:
-            X_balance = X
-            Y_balance = Y
+    Parameters
+    ----------
+    X : numpy array or sparse matrix with encoded comments
+    Y : numpy array with comment labels
+    batch_size : int
+    shuffle : bool
+        Shuffle the balanced rows each epoch
+    random_state : int or numpy RandomState, optional
+
+    Yields
+    ------
+    X_batch, Y_batch : numpy arrays
+    '''
+    rng = get_random_state(random_state)
 
-        X_balance = np.vstack((X_balance, X_array_to_append))
-        Y_balance = np.vstack((Y_balance, Y_array_to_append))
+    while True:
+        index = get_balanced_indices(Y, rng)
+        if shuffle:
+            rng.shuffle(index)
 
-    return X_balance, Y_balance
+        for start in range(0, len(index), batch_size):
+            batch = index[start:start + batch_size]
+            yield X[batch], Y[batch]
 
 
 def build_vocab(sentences, verbose=True):
@@ -20,6 +20,16 @@ python src/data/sensitive_text.py \
 --skiprows 1
 '''
 
+# USAGE for a large xlsx, desensitized in checkpointed chunks that resume
+# after an interruption:
+'''
+python src/data/sensitive_text.py \
+--input_xlsx data/raw/2018\ WES\ Qual\ Coded\ -\ Final\ Comments\ and\ Codes.xlsx \
+--output_csv data/interim/desensitized_qualitative-data2018.csv \
+--skiprows 1 \
+--chunksize 5000
+'''
+
 # USAGE for Sample Data:
 '''
 python src/data/sensitive_text.py \
@@ -30,7 +40,16 @@ python src/data/sensitive_text.py \
 
 
 # Import Modules
+import os
+import re
+import sys
+import json
+import time
+import pickle
+import openpyxl
 import pandas as pd
+from pandas.io.parsers import TextParser
+from itertools import islice, compress
 import spacy
 import argparse
 import numpy as np
@@ -56,21 +75,41 @@ def get_arguments():
                         action='store', default='1',
                         help='Number of rows to skip when reading xlsx')
 
+    parser.add_argument('--batch_size', '-b', type=int, dest='batch_size',
+                        action='store', default=1000,
+                        help='Number of comments per spaCy batch')
+
+    parser.add_argument('--n_process', '-n', type=int, dest='n_process',
+                        action='store', default=1,
+                        help='Number of processes running spaCy')
+
+    parser.add_argument('--chunksize', '-c', type=int, dest='chunksize',
+                        action='store', default=0,
+                        help='Number of rows to desensitize at a time. The '
+                        'output is checkpointed after each chunk so an '
+                        'interrupted run resumes. 0 reads the whole xlsx')
+
+    parser.add_argument('--full_ner', dest='full_ner', action='store_true',
+                        help='Run NER on every comment instead of only the '
+                        'comments containing a name')
+
+    parser.add_argument('--verify_gate', dest='verify_gate',
+                        action='store_true',
+                        help='Check the name gate flags the same comments as '
+                        'running NER on every comment')
+
     args = parser.parse_args()
     return args
 
 
 ###############################################################################
-# Create name_check list based on US Census data to be used in the            #
-# sensitive_text function                                                     #
+# Name index based on US Census data to be used in the sensitive_text         #
+# function. It is loaded lazily so importing this module stays cheap          #
 ###############################################################################
 
-# File Paths to read in datadictionary
+# File Paths to read in datadictionary and its binary cache
 filepath_names = "./references/data-dictionaries/NationalNames.csv"
-
-# Read in data dictionary
-df_names = pd.read_csv(filepath_names)
-name_check = df_names.Name.unique().tolist()
+filepath_names_cache = "./references/data-dictionaries/NationalNames.pickle"
 
 # Names that are in the names list and NER labels as Person, but are not
 # actually sensitive. ie. they are false positives
@@ -79,64 +118,455 @@ false_names = ['Sheriff', 'Law', 'Child', 'Warden', 'Care', 'Cloud', 'Honesty',
                'Branch', 'Field', 'Langford', 'Surrey', 'Cap', 'Lean', 'Van',
                'Case', 'Min', 'Merit', 'Job', 'Win', 'Forest', 'Victoria']
 
-# Drop the false_names from the names list
-name_check = list(set(name_check).difference(set(false_names)))
-
 # Names that are not in the names list, but should be! ie. false negatives
 missing_names = ['Kristofferson']
 
-# Add missing names
-for missing_name in missing_names:
-    name_check.append(missing_name)
+# Set of names built by get_name_index on first use
+name_index = None
+
+
+def load_names(filepath=filepath_names, cache_filepath=filepath_names_cache):
+    """Return the sorted unique names in the names csv. The names are cached
+    in a pickle next to the csv and the cache is rebuilt when the csv is
+    newer."""
+
+    if os.path.exists(cache_filepath) and \
+            os.path.getmtime(cache_filepath) >= os.path.getmtime(filepath):
+        with open(cache_filepath, 'rb') as handle:
+            return pickle.load(handle)
+
+    names = sorted(pd.read_csv(filepath, usecols=['Name']).Name.unique())
+    with open(cache_filepath, 'wb') as handle:
+        pickle.dump(names, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return names
+
+
+def get_name_index():
+    """Return the set of names used to confirm PERSON entities, with the
+    false_names removed and the missing_names added"""
+
+    global name_index
+    if name_index is None:
+        name_index = frozenset(load_names()).difference(false_names)\
+                                            .union(missing_names)
+
+    return name_index
 
 
 ###############################################################################
 # Define functions and set up script to run in command line                   #
 ###############################################################################
-def find_sensitive_text(comments):
-    """Return a list of indices identifying comments with sensitive information
-    given a list of comments"""
+# spaCy models loaded by get_nlp, so each model is only loaded once
+nlp_models = {}
 
-    # Apply Named entity recognition on list of comments
-    nlp = spacy.load("en_core_web_sm")
-    docs = [nlp(str(comment)) for comment in comments]
 
-    # Create a list of the words tagged as PERSON and the original index
-    person_index = []
-    person_list = []
-    for index, doc in enumerate(docs):
-        for ent in doc.ents:
-            if ent.label_ == "PERSON":
-                person_index.append(index)
-                person_list.append(ent.text)
+def get_nlp(model="en_core_web_sm"):
+    """Return the spaCy model with only named entity recognition enabled.
+    The tagger and parser are not needed to find PERSON entities."""
+
+    if model not in nlp_models:
+        nlp_models[model] = spacy.load(model, disable=["tagger", "parser"])
+
+    return nlp_models[model]
+
 
-    # Cross check a name dictionary to confirm names
-    sensitive_person = []
+# Runs of letters, the only words that can match a name in the index
+letters_re = re.compile(r'[^\W\d_]+')
+
+
+def find_candidate_comments(comments):
+    """Return the indices of the comments containing a word in the name index.
+    Only these comments can be flagged by find_sensitive_text, as a PERSON
+    entity is confirmed by one of its words being in the name index."""
+
+    names = get_name_index()
+
+    return [index for index, comment in enumerate(comments)
+            if not names.isdisjoint(letters_re.findall(str(comment)))]
+
+
+def find_person_text(comments, batch_size=1000, n_process=1):
+    """Return the indices of the comments with a PERSON entity that is
+    confirmed by the name index. Comments are streamed through spaCy in
+    batches and each Doc is dropped once its entities are checked."""
+
+    nlp = get_nlp()
+    names = get_name_index()
+    docs = nlp.pipe((str(comment) for comment in comments),
+                    batch_size=batch_size, n_process=n_process)
+
+    # Cross check the words tagged as PERSON with a name dictionary to
+    # confirm names, keeping the original index
     sensitive_person_index = []
-    for index, person in enumerate(person_list):
-        for name in person.split():
-            if name in name_check:
-                sensitive_person.append(person)
-                sensitive_person_index.append(person_index[index])
-                break
+    for index, doc in enumerate(docs):
+        for ent in doc.ents:
+            if ent.label_ != "PERSON":
+                continue
+            for name in ent.text.split():
+                if name in names:
+                    sensitive_person_index.append(index)
+                    break
 
     return sensitive_person_index
 
 
-def remove_sensitive_text(filepath, skiprows):
+def find_sensitive_text(comments, batch_size=1000, n_process=1, gate=True):
+    """Return a list of indices identifying comments with sensitive information
+    given a list of comments. With gate=True only the comments containing a
+    word in the name index are sent through spaCy."""
+
+    if not gate:
+        return find_person_text(comments, batch_size, n_process)
+
+    comments = list(comments)
+    candidates = find_candidate_comments(comments)
+    person_index = find_person_text([comments[index] for index in candidates],
+                                    batch_size, n_process)
+
+    return [candidates[index] for index in person_index]
+
+
+def verify_gate(comments, batch_size=1000, n_process=1):
+    """Run find_sensitive_text with and without the name gate and return
+    whether they flag the same indices, with the time taken by each"""
+
+    comments = list(comments)
+
+    start = time.time()
+    gated = find_sensitive_text(comments, batch_size, n_process, gate=True)
+    gated_seconds = time.time() - start
+
+    start = time.time()
+    full = find_sensitive_text(comments, batch_size, n_process, gate=False)
+    full_seconds = time.time() - start
+
+    return {'same_indices': gated == full,
+            'candidates': len(find_candidate_comments(comments)),
+            'comments': len(comments),
+            'gated_seconds': round(gated_seconds, 1),
+            'full_seconds': round(full_seconds, 1),
+            'speedup': round(full_seconds / max(gated_seconds, 1e-6), 1)}
+
+
+def remove_sensitive_text(filepath, skiprows, batch_size=1000, n_process=1,
+                          gate=True):
 
     df = pd.read_excel(filepath, skiprows=skiprows)
     df = df[df.iloc[:, 1].isnull() == False]
     comments = df.iloc[:, 1]
-    sensitive_indices = find_sensitive_text(comments)
-    df = df.drop(index=sensitive_indices)
+
+    start = time.time()
+    sensitive_indices = find_sensitive_text(comments, batch_size, n_process,
+                                            gate)
+    seconds = time.time() - start
+    # The clock can read 0 seconds for an empty or tiny sheet
+    print('Checked', len(comments), 'comments in', round(seconds, 1),
+          'seconds,', round(len(comments) / max(seconds, 1e-6)),
+          'comments per second')
+
+    df = df.drop(index=df.index[sensitive_indices])
 
     return(df)
 
 
+def convert_cell(cell):
+    """Convert an openpyxl cell the same way pd.read_excel does. Empty cells
+    are '', errors are NaN and whole number floats are ints."""
+
+    if cell.value is None:
+        return ''
+    elif cell.data_type == 'e':
+        return np.nan
+    elif cell.data_type == 'n':
+        value = int(cell.value)
+        if value == cell.value:
+            return value
+        return float(cell.value)
+
+    return cell.value
+
+
+def iter_excel_rows(filepath, skiprows):
+    """Yield the converted rows of the first sheet of an xlsx after skiprows,
+    reading it in read-only mode. Trailing empty cells are trimmed from each
+    row like pd.read_excel."""
+
+    workbook = openpyxl.load_workbook(filepath, read_only=True,
+                                      data_only=True)
+    sheet = workbook.worksheets[0]
+    sheet.reset_dimensions()
+
+    try:
+        for row in islice(sheet.rows, skiprows, None):
+            row = [convert_cell(cell) for cell in row]
+            while row and row[-1] == '':
+                row.pop()
+            yield row
+    finally:
+        workbook.close()
+
+
+def parse_excel_rows(header, rows, width, dtype=None):
+    """Parse the rows under the header into a data frame with the same
+    TextParser settings as pd.read_excel, after padding them to width.
+    pd.read_excel parses the sheet rows with this TextParser too, and
+    tests/test_sensitive_text.py checks the chunked csv is the same as the
+    one written from pd.read_excel with the installed pandas."""
+
+    data = [row + [''] * (width - len(row)) for row in [header] + rows]
+
+    return TextParser(data, header=0, skip_blank_lines=False,
+                      dtype=dtype).read()
+
+
+def get_value_kind(value):
+    """The kind of a cell value for inferring the dtype of its column, with
+    strings of numbers kept apart from other strings"""
+
+    if isinstance(value, str):
+        for kind in [int, float]:
+            try:
+                kind(value)
+                return 'str_' + kind.__name__
+            except ValueError:
+                pass
+
+    return type(value).__name__
+
+
+def get_excel_plan(filepath, skiprows, chunksize):
+    """Read the xlsx once to find what pd.read_excel infers for the whole
+    sheet, so every chunk is written the same way.
+
+    pd.read_excel pads the rows to the widest row, drops the trailing empty
+    rows and infers the dtype of each column from all of its values. The
+    dtype of a column is inferred here from one value of each kind in the
+    column and whether it has missing values, unless a chunk is read as
+    text, in which case the whole column is. Datetime columns are written
+    as dates when every value is at midnight, as to_csv would for the whole
+    column.
+
+    Returns
+    -------
+    plan : dict with the width and number of rows of the sheet, and the
+           dtype name and date format, or None, of each column. It is saved
+           to JSON with the checkpoint so a resumed run does not read the
+           sheet again.
+    """
+    rows = iter_excel_rows(filepath, skiprows)
+    header = next(rows)
+
+    chunks, chunk_widths, n_rows = [], [], 0
+    exemplars, missing, text = {}, set(), set()
+    midnight, fraction = {}, set()
+
+    def read_chunk():
+        chunk_widths.append(max([len(header)] + [len(row) for row in chunks]))
+        df = parse_excel_rows(header, chunks, chunk_widths[-1])
+        for i, column in enumerate(df.columns):
+            values = df[column]
+            present = values.notna().to_numpy()
+            if not present.all():
+                missing.add(i)
+            if pd.api.types.is_string_dtype(values.dtype):
+                text.add(i)
+            elif present.any():
+                for row in compress(chunks, present):
+                    exemplars.setdefault(i, {}).setdefault(
+                        get_value_kind(row[i]), row[i])
+                if pd.api.types.is_datetime64_any_dtype(values.dtype):
+                    times = values[present]
+                    midnight[i] = midnight.get(i, True) and \
+                        bool((times == times.dt.normalize()).all())
+                    if (times.dt.microsecond != 0).any():
+                        fraction.add(i)
+
+    # Empty rows are only kept if a row with data follows them
+    empty_rows = 0
+    for row in rows:
+        if not row:
+            empty_rows += 1
+            continue
+        for row in [[]] * empty_rows + [row]:
+            chunks.append(row)
+            n_rows += 1
+            if len(chunks) == chunksize:
+                read_chunk()
+                chunks = []
+        empty_rows = 0
+    if chunks:
+        read_chunk()
+
+    # Rows narrower than the widest row are padded with missing values
+    width = max(chunk_widths, default=len(header))
+    missing.update(range(min(chunk_widths, default=width), width))
+
+    dtypes, date_formats = [], []
+    for i in range(width):
+        if i in text:
+            dtypes.append('object')
+            date_formats.append(None)
+            continue
+
+        values = [[value] for value in exemplars.get(i, {}).values()]
+        if i in missing:
+            values.append([''])
+        dtype = parse_excel_rows(['x'], values, 1)['x'].dtype
+        dtypes.append(dtype.name)
+
+        if not pd.api.types.is_datetime64_any_dtype(dtype):
+            date_formats.append(None)
+        elif midnight.get(i, True):
+            date_formats.append('%Y-%m-%d')
+        elif i in fraction:
+            date_formats.append('%Y-%m-%d %H:%M:%S.%f')
+        else:
+            date_formats.append('%Y-%m-%d %H:%M:%S')
+
+    return {'width': width, 'rows': n_rows, 'dtypes': dtypes,
+            'date_formats': date_formats}
+
+
+def read_excel_chunks(filepath, skiprows, chunksize, start=0, plan=None):
+    """Read the first sheet of an xlsx in read-only mode and yield data frames
+    of chunksize rows, skipping the first start rows after the header. The
+    columns, missing values, dtypes and dates are the same as reading the
+    whole sheet with pd.read_excel, so writing the chunks to a csv gives the
+    same file as writing the whole sheet. The plan of get_excel_plan is
+    computed first unless it is given."""
+
+    if plan is None:
+        plan = get_excel_plan(filepath, skiprows, chunksize)
+    width = plan['width']
+    dtypes = [pd.api.types.pandas_dtype(dtype) for dtype in plan['dtypes']]
+
+    sheet_rows = iter_excel_rows(filepath, skiprows)
+    header = next(sheet_rows)
+    columns = parse_excel_rows(header, [], width).columns
+    text_dtypes = {column: object for column, dtype in zip(columns, dtypes)
+                   if dtype == object}
+
+    rows = islice(sheet_rows, start, plan['rows'])
+    while True:
+        chunk = list(islice(rows, chunksize))
+        if not chunk:
+            break
+
+        df = parse_excel_rows(header, chunk, width, text_dtypes)
+        for column, dtype, date_format in zip(columns, dtypes,
+                                              plan['date_formats']):
+            values = df[column]
+            if dtype == object or values.isna().all():
+                continue
+            if values.dtype != dtype:
+                values = values.astype(dtype)
+            if date_format is not None:
+                values = values.dt.strftime(date_format)\
+                               .astype(object).where(values.notna())
+            df[column] = values
+        yield df
+
+    sheet_rows.close()
+
+
+def remove_sensitive_text_chunked(filepath, skiprows, output_csv,
+                                  chunksize=5000, batch_size=1000,
+                                  n_process=1, gate=True):
+    """Desensitize an xlsx chunk by chunk and append each chunk to the csv.
+
+    The csv is written to output_csv + '.partial' and only renamed to
+    output_csv once every chunk is done. The plan of get_excel_plan, and
+    after each chunk the number of rows read and the size of the partial
+    csv, are saved to output_csv + '.checkpoint', so an interrupted run
+    resumes from the last finished chunk without reading the sheet again.
+    A run does not resume if the xlsx or the chunksize changed since the
+    checkpoint."""
+
+    filepath_partial = output_csv + '.partial'
+    filepath_checkpoint = output_csv + '.checkpoint'
+
+    def save_checkpoint():
+        with open(filepath_checkpoint + '.tmp', 'w') as checkpoint:
+            json.dump(state, checkpoint)
+        os.replace(filepath_checkpoint + '.tmp', filepath_checkpoint)
+
+    stat = os.stat(filepath)
+    state = {'input_xlsx': os.path.abspath(filepath), 'skiprows': skiprows,
+             'mtime': stat.st_mtime, 'size': stat.st_size,
+             'chunksize': chunksize, 'rows': 0, 'bytes': 0}
+    checkpoint = None
+    if os.path.exists(filepath_checkpoint) and \
+            os.path.exists(filepath_partial):
+        with open(filepath_checkpoint) as handle:
+            checkpoint = json.load(handle)
+
+    if checkpoint is not None and \
+            checkpoint['input_xlsx'] == state['input_xlsx'] and \
+            checkpoint['skiprows'] == skiprows:
+        if [checkpoint.get('mtime'), checkpoint.get('size')] != \
+                [state['mtime'], state['size']]:
+            raise ValueError('%s changed since the checkpoint, delete %s to '
+                             'start over' % (filepath, filepath_checkpoint))
+        if checkpoint.get('chunksize') != chunksize:
+            raise ValueError('the checkpoint was written with chunksize %s, '
+                             'resume with the same chunksize or delete %s to '
+                             'start over' % (checkpoint.get('chunksize'),
+                                             filepath_checkpoint))
+        state = checkpoint
+        print('Resuming after', state['rows'], 'rows')
+    else:
+        state['plan'] = get_excel_plan(filepath, skiprows, chunksize)
+        with open(filepath_partial, 'wb'):
+            pass
+        save_checkpoint()
+
+    # Drop anything written after the last checkpoint
+    with open(filepath_partial, 'a+b') as handle:
+        handle.truncate(state['bytes'])
+
+    with open(filepath_partial, 'a', newline='', encoding='utf-8') as handle:
+        for df in read_excel_chunks(filepath, skiprows, chunksize,
+                                    state['rows'], state['plan']):
+            rows = len(df)
+            df = df[df.iloc[:, 1].isnull() == False]
+            sensitive_indices = find_sensitive_text(df.iloc[:, 1], batch_size,
+                                                    n_process, gate)
+            df = df.drop(index=df.index[sensitive_indices])
+
+            df.to_csv(handle, header=(state['bytes'] == 0), index=False)
+            handle.flush()
+            os.fsync(handle.fileno())
+
+            state['rows'] += rows
+            state['bytes'] = handle.tell()
+            save_checkpoint()
+            print('Desensitized', state['rows'], 'rows')
+
+    os.replace(filepath_partial, output_csv)
+    if os.path.exists(filepath_checkpoint):
+        os.remove(filepath_checkpoint)
+
+
 ###############################################################################
 if __name__ == "__main__":
 
     args = get_arguments()
-    df = remove_sensitive_text(args.input_xlsx, args.skiprows)
+
+    if args.verify_gate:
+        df = pd.read_excel(args.input_xlsx, skiprows=args.skiprows)
+        comments = df.iloc[:, 1].dropna()
+        print(verify_gate(comments, args.batch_size, args.n_process))
+        sys.exit()
+
+    if args.chunksize > 0:
+        remove_sensitive_text_chunked(args.input_xlsx, args.skiprows,
+                                      args.output_csv, args.chunksize,
+                                      args.batch_size, args.n_process,
+                                      not args.full_ner)
+        sys.exit()
+
+    df = remove_sensitive_text(args.input_xlsx, args.skiprows,
+                               args.batch_size, args.n_process,
+                               not args.full_ner)
     df.to_csv(args.output_csv, index=False)
@@ -11,6 +11,16 @@ python src/data/split_qual_data.py \
 --output_csv2 data/interim/train_2018-qualitative-data.csv
 '''
 
+# With --hash_split each comment is assigned to test or train from a hash of
+# its USERID instead of a random sample. The csv is streamed in chunks and the
+# split of a comment does not change when new comments are appended. The
+# USERID is read as a string, so its split does not depend on the dtype
+# pandas infers for each chunk. Comments without a USERID are kept in train.
+
+import re
+import sys
+import hashlib
+import numpy as np
 import pandas as pd
 import argparse
 
@@ -36,18 +46,102 @@ def get_arguments():
                         action='store', default=filepath_out_train,
                         help='the train output csv file')
 
+    parser.add_argument('--hash_split', dest='hash_split',
+                        action='store_true', default=False,
+                        help='split on a hash of the USERID in one pass')
+
+    parser.add_argument('--test_frac', '-f', type=float, dest='test_frac',
+                        action='store', default=0.1,
+                        help='fraction of comments in the test set')
+
+    parser.add_argument('--chunksize', type=int, dest='chunksize',
+                        action='store', default=10000,
+                        help='number of rows read at a time for --hash_split')
+
     args = parser.parse_args()
     return args
 
 
+def normalize_user_id(user_id):
+    '''Returns the USERID as a string, with '1036.0' written as '1036', or
+    None when it is missing'''
+
+    if user_id is None or (isinstance(user_id, float) and np.isnan(user_id)):
+        return None
+
+    user_id = str(user_id).strip()
+    if not user_id or user_id.lower() == 'nan':
+        return None
+
+    return re.sub(r'^(-?[0-9]+)\.0*$', r'\1', user_id)
+
+
+def get_test_mask(user_ids, test_frac=0.1, salt='2019'):
+    '''Assign each USERID to the test set from a stable hash. Missing
+    USERIDs are never in the test set.
+
+    Parameters
+    ----------
+    user_ids : Pandas series object
+    test_frac : float
+        The expected fraction of USERIDs in the test set
+    salt : str
+        Changing the salt gives a different split
+
+    Returns
+    -------
+    mask : boolean numpy array, True for the test set
+    '''
+    threshold = int(test_frac * 2 ** 64)
+
+    mask = []
+    for user_id in map(normalize_user_id, user_ids):
+        mask.append(user_id is not None and int.from_bytes(
+            hashlib.blake2b((salt + user_id).encode(), digest_size=8)
+            .digest(), 'big') < threshold)
+
+    return np.array(mask, dtype=bool)
+
+
+def hash_split(input_csv, output_test, output_train, test_frac=0.1,
+               chunksize=10000, salt='2019'):
+    '''Split a comment csv on a hash of the USERID in the first column,
+    reading and writing the csv files one chunk at a time
+
+    Returns
+    -------
+    n_test, n_train : the number of comments written to each csv
+    '''
+    n_test, n_train = 0, 0
+    with open(output_test, 'w', newline='') as handle_test, \
+            open(output_train, 'w', newline='') as handle_train:
+        chunks = pd.read_csv(input_csv, chunksize=chunksize, dtype={0: str})
+        for i, df in enumerate(chunks):
+            mask = get_test_mask(df.iloc[:, 0], test_frac, salt)
+            df[mask].to_csv(handle_test, header=(i == 0), index=False)
+            df[~mask].to_csv(handle_train, header=(i == 0), index=False)
+            n_test += mask.sum()
+            n_train += (~mask).sum()
+
+    return n_test, n_train
+
+
 ###############################################################################
 if __name__ == "__main__":
 
     args = get_arguments()
 
+    if args.hash_split:
+        n_test, n_train = hash_split(args.input_csv, args.output_csv1,
+                                     args.output_csv2, args.test_frac,
+                                     args.chunksize)
+        print('Wrote', n_test, 'test and', n_train, 'train comments')
+        sys.exit()
+
     df_raw_2018 = pd.read_csv(args.input_csv)
 
-    df_test_2018 = df_raw_2018.sample(frac=0.1, random_state=2019)
+    df_test_2018 = df_raw_2018.sample(frac=args.test_frac,
+                                      random_state=2019)
     df_train_2018 = df_raw_2018.drop(index=df_test_2018.index)
 
     df_test_2018.to_csv(path_or_buf=args.output_csv1, index=False)
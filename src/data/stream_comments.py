@@ -0,0 +1,80 @@
+# stream_comments.py
+# Authors: Aaron Quinton
+# Date: 2019-07-03
+
+# Generators to read comment csv files in chunks so the feature scripts can
+# process one ministry or every survey year with the same peak memory. The
+# csv files are expected to have the USERID in the first column and the
+# comment in the second, as written by split_qual_data.py.
+
+# Import modules
+import pandas as pd
+from src.data.preprocessing_text import get_normalizer, get_profile
+from src.data.preprocessing_text import remove_stopwords
+
+
+def read_comment_chunks(filepath, chunksize=10000):
+    '''Read the USERID and comment columns of a csv in chunks
+
+    Parameters
+    ----------
+    filepath : str
+        The csv file with the USERID and comment in the first two columns
+    chunksize : int
+        The number of rows in each chunk
+
+    Yields
+    ------
+    user_ids : Pandas series object
+    comments : Pandas series object
+    '''
+    for df in pd.read_csv(filepath, usecols=[0, 1], chunksize=chunksize):
+        yield df.iloc[:, 0], df.iloc[:, 1]
+
+
+def preprocess_comment_chunks(filepath, embeddings_index, chunksize=10000,
+                              cache=None, tokenize=True):
+    '''Read and preprocess a comment csv in chunks
+
+    Parameters
+    ----------
+    filepath : str
+        The csv file with the USERID and comment in the first two columns
+    embeddings_index : str
+        The name of the pretrained embedding, or 'bow'
+    chunksize : int
+        The number of rows in each chunk
+    cache : PreprocessingCache, optional
+    tokenize : bool
+        Whether to split the comments into tokens without stopwords. The bow
+        vectorizers only use the text, so they skip it.
+
+    Yields
+    ------
+    user_ids : Pandas series object
+    text : Pandas series object with the normalized comments
+    tokens : list of tokenized words for each comment, or None if tokenize
+             is False
+    '''
+    if embeddings_index == 'bow':
+        normalizer = get_normalizer('bow')
+    else:
+        normalizer = get_normalizer(get_profile(embeddings_index))
+
+    for user_ids, comments in read_comment_chunks(filepath, chunksize):
+        text = normalizer.transform(comments, cache=cache)
+        tokens = remove_stopwords(text.str.split()) if tokenize else None
+        yield user_ids, text, tokens
+
+
+def iter_preprocessed_comments(filepath, embeddings_index, chunksize=10000,
+                               cache=None):
+    '''Read and preprocess a comment csv one comment at a time
+
+    Yields
+    ------
+    (USERID, normalized text, tokens) for each comment
+    '''
+    for user_ids, text, tokens in preprocess_comment_chunks(
+            filepath, embeddings_index, chunksize, cache):
+        yield from zip(user_ids, text, tokens)
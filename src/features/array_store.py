@@ -0,0 +1,122 @@
+# array_store.py
+# Author: Aaron Quinton
+# Date: 2019-07-12
+
+# The encoded comments and embedding matrices were pickled as one dict with
+# an item for each embedding, so every script unpickled all of them even if
+# it used one. This module saves such a dict as a directory with one .npy
+# file per array and a manifest.json. Integer arrays are saved with the
+# smallest dtype that holds their values, int16 for token indices below
+# 32768. Scripts open only the arrays they need, memory mapped, so nothing is
+# copied until it is used.
+#
+# Ragged encodings from ragged_sequences.py are saved as <name>.values.npy
+# and <name>.offsets.npy. load_arrays also reads the old pickle files.
+
+# Import Modules
+import os
+import json
+import pickle
+import numpy as np
+from src.features.ragged_sequences import is_ragged
+
+
+def get_compact_dtype(array):
+    '''Returns the smallest signed integer dtype that holds the values of an
+    integer array, or the dtype of any other array'''
+
+    if not np.issubdtype(array.dtype, np.integer) or array.size == 0:
+        return array.dtype
+
+    low, high = array.min(), array.max()
+    for dtype in [np.int8, np.int16, np.int32, np.int64]:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+
+    return array.dtype
+
+
+def save_arrays(dirpath, arrays, compact=True):
+    '''Save a dict of arrays or ragged encodings to a directory. The
+    manifest is written last, so a directory with a manifest is complete.
+
+    Parameters
+    ----------
+    dirpath : str
+    arrays : dict with an array or ragged encoding for each name
+    compact : bool
+        Save integer arrays with the smallest dtype that holds the values
+    '''
+    os.makedirs(dirpath, exist_ok=True)
+
+    manifest = {}
+    for name, array in arrays.items():
+        if is_ragged(array):
+            values = array['values']
+            if compact:
+                values = values.astype(get_compact_dtype(values), copy=False)
+            np.save(os.path.join(dirpath, name + '.values.npy'), values)
+            np.save(os.path.join(dirpath, name + '.offsets.npy'),
+                    array['offsets'])
+            manifest[name] = {'kind': 'ragged', 'dtype': values.dtype.name,
+                              'rows': len(array['offsets']) - 1}
+        else:
+            array = np.asarray(array)
+            if compact:
+                array = array.astype(get_compact_dtype(array), copy=False)
+            np.save(os.path.join(dirpath, name + '.npy'), array)
+            manifest[name] = {'kind': 'dense', 'dtype': array.dtype.name,
+                              'shape': list(array.shape)}
+
+    with open(os.path.join(dirpath, 'manifest.json'), 'w') as handle:
+        json.dump(manifest, handle, indent=2)
+
+
+def save_arrays_or_pickle(filepath, arrays):
+    '''Pickle the dict of arrays to a .pickle file, and save it as an array
+    directory otherwise'''
+
+    if filepath.endswith('.pickle'):
+        with open(filepath, 'wb') as handle:
+            pickle.dump(arrays, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    else:
+        save_arrays(filepath, arrays)
+
+
+def load_arrays(filepath, names=None, mmap_mode='r'):
+    '''Open the arrays of an array directory with memory maps, or read them
+    from a pickled dict
+
+    Parameters
+    ----------
+    filepath : str
+        An array directory or a pickle file
+    names : list, optional
+        The arrays to open, all of them by default
+
+    Returns
+    -------
+    arrays : dict with an array or ragged encoding for each name
+    '''
+    if not os.path.isdir(filepath):
+        with open(filepath, 'rb') as handle:
+            arrays = pickle.load(handle)
+        return {name: arrays[name] for name in (names or list(arrays))}
+
+    with open(os.path.join(filepath, 'manifest.json')) as handle:
+        manifest = json.load(handle)
+
+    arrays = {}
+    for name in (names or list(manifest)):
+        if manifest[name]['kind'] == 'ragged':
+            arrays[name] = {
+                'values': np.load(os.path.join(filepath, name + '.values.npy'),
+                                  mmap_mode=mmap_mode),
+                'offsets': np.load(os.path.join(filepath,
+                                                name + '.offsets.npy'),
+                                   mmap_mode=mmap_mode)}
+        else:
+            arrays[name] = np.load(os.path.join(filepath, name + '.npy'),
+                                   mmap_mode=mmap_mode)
+
+    return arrays
@@ -2,22 +2,40 @@
 # Author: Fan Nie, Ayla Pearson, Aaron Quinton
 # Date: 2019-06-11
 
-# This script file builds the bow vectorizer to be used later in the model
+# This script file builds the bow vectorizer to be used later in the model.
+# With --n_features the n-grams are hashed into a fixed number of buckets
+# instead of fitting a vocabulary, which bounds the memory used and keeps the
+# pickled vectorizer small. A streaming pass then drops the buckets of fewer
+# than --min_df comments.
 
 # USAGE:
 '''
 python src/features/bow_vectorizer.py \
 --input_csv data/interim/train_2018-qualitative-data.csv \
---output_pk models/bow_vectorizer.pickle
+--output_pk models/bow_vectorizer.pickle \
+--cache_db data/interim/preprocessing_cache.sqlite
+'''
+
+# USAGE for the hashed vectorizer:
+'''
+python src/features/bow_vectorizer.py \
+--input_csv data/interim/train_2018-qualitative-data.csv \
+--output_pk models/bow_vectorizer.pickle \
+--cache_db data/interim/preprocessing_cache.sqlite \
+--n_features 1048576
 '''
 
 
 # Import Modules
 import sys
 sys.path.insert(1, '.')
-import pandas as pd
 from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.feature_extraction.text import HashingVectorizer
 from src.data.preprocessing_text import preprocess_for_bow
+from src.data.preprocessing_text import PreprocessingCache
+from src.data.stream_comments import preprocess_comment_chunks
+from itertools import islice
+import numpy as np
 import scipy
 import argparse
 import pickle
@@ -40,17 +58,105 @@ def get_arguments():
                         action='store', default=filepath_out,
                         help='the test output csv file')
 
+    parser.add_argument('--cache_db', '-c', type=str, dest='cache_db',
+                        action='store', default=None,
+                        help='optional sqlite cache of preprocessed comments')
+
+    parser.add_argument('--chunksize', type=int, dest='chunksize',
+                        action='store', default=10000,
+                        help='number of comments read from the csv at a time')
+
+    parser.add_argument('--n_features', '-n', type=int, dest='n_features',
+                        action='store', default=None,
+                        help='optional number of buckets to hash n-grams into '
+                        'instead of fitting a vocabulary')
+
+    parser.add_argument('--min_df', type=int, dest='min_df',
+                        action='store', default=2,
+                        help='minimum number of comments of an n-gram, or of '
+                        'a bucket for the hashed vectorizer')
+
     args = parser.parse_args()
     return args
 
 
-def get_bow_vectorizer(comments):
+class HashedBowVectorizer:
+    '''Counts the same 1 to 5-grams as the CountVectorizer of
+    fit_bow_vectorizer, hashed into n_features buckets. Without min_df the
+    vectorizer is stateless and needs no fitting. With min_df > 1, fit makes
+    one pass over the comments to count the comments in each bucket and
+    transform keeps only the buckets of at least min_df comments.
 
-    vectorizer = CountVectorizer(stop_words='english', ngram_range=(1, 5),
-                                 min_df=2)
-    comments = preprocess_for_bow(comments)
+    Parameters
+    ----------
+    n_features : int
+        The number of buckets
+    min_df : int
+        The minimum number of comments of a bucket
+    batch_size : int
+        The number of comments hashed at a time while fitting
+    '''
+    def __init__(self, n_features=2 ** 20, min_df=1, batch_size=10000):
+        self.n_features = n_features
+        self.min_df = min_df
+        self.batch_size = batch_size
+        self.hasher = HashingVectorizer(stop_words='english',
+                                        ngram_range=(1, 5),
+                                        n_features=n_features,
+                                        alternate_sign=False, norm=None,
+                                        dtype=np.int64)
+        self.columns = None
+
+    def fit(self, texts):
+        '''Count the comments in each bucket from an iterable of
+        preprocessed comments, which can be a generator'''
+
+        if self.min_df <= 1:
+            return self
+
+        texts = iter(texts)
+        doc_freq = np.zeros(self.n_features, dtype=np.int64)
+        while True:
+            batch = list(islice(texts, self.batch_size))
+            if not batch:
+                break
+            X = self.hasher.transform(batch)
+            doc_freq += np.bincount(X.indices, minlength=self.n_features)
+
+        self.columns = np.flatnonzero(doc_freq >= self.min_df)
 
-    vectorizer.fit(comments)
+        return self
+
+    def transform(self, texts):
+        X = self.hasher.transform(texts)
+        if self.columns is not None:
+            X = X[:, self.columns]
+
+        return X.tocsr()
+
+    def fit_transform(self, texts):
+        texts = list(texts)
+        return self.fit(texts).transform(texts)
+
+
+def get_bow_vectorizer(comments, cache=None, n_features=None, min_df=2):
+
+    comments = preprocess_for_bow(comments, cache)
+
+    return fit_bow_vectorizer(comments, n_features, min_df)
+
+
+def fit_bow_vectorizer(texts, n_features=None, min_df=2):
+    '''Fit the bow vectorizer on an iterable of preprocessed comments, which
+    can be a generator so the comments are never all held in memory. With
+    n_features the n-grams are hashed with a HashedBowVectorizer.'''
+
+    if n_features is not None:
+        return HashedBowVectorizer(n_features, min_df).fit(texts)
+
+    vectorizer = CountVectorizer(stop_words='english', ngram_range=(1, 5),
+                                 min_df=min_df)
+    vectorizer.fit(texts)
 
     return vectorizer
 
@@ -59,10 +165,14 @@ def get_bow_vectorizer(comments):
 if __name__ == "__main__":
 
     args = get_arguments()
-    df = pd.read_csv(args.input_csv)
-    comments = df.iloc[:, 1]
-
-    bow_vectorizer = get_bow_vectorizer(comments)
+    cache = PreprocessingCache(args.cache_db)
+
+    chunks = preprocess_comment_chunks(args.input_csv, 'bow', args.chunksize,
+                                       cache, tokenize=False)
+    bow_vectorizer = fit_bow_vectorizer((text for _, texts, _ in chunks
+                                         for text in texts),
+                                        args.n_features, args.min_df)
+    cache.close()
 
     with open(args.output_pk, 'wb') as handle:
         pickle.dump(bow_vectorizer, handle, protocol=pickle.HIGHEST_PROTOCOL)
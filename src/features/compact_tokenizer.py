@@ -0,0 +1,149 @@
+# compact_tokenizer.py
+# Author: Aaron Quinton
+# Date: 2019-07-13
+
+# models/embed_tokenizers.pickle holds the fitted keras Tokenizers with the
+# counts of every word in the comments, and unpickling them imports keras and
+# TensorFlow. Only the words with an index below num_words are ever used to
+# encode comments, so this script saves the three tokenizers to a JSON file
+# with just those words and their settings. CompactTokenizer encodes comments
+# from the JSON file with the same sequences as the keras Tokenizer, without
+# importing keras.
+
+# USAGE:
+'''
+python src/features/compact_tokenizer.py \
+--input_pk models/embed_tokenizers.pickle \
+--output_json models/embed_tokenizers.json
+'''
+
+# Import Modules
+import sys
+sys.path.insert(1, '.')
+import json
+import pickle
+import argparse
+from src.features.shared_tokens import keras_filters, text_to_word_sequence
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Save fitted keras '
+                                     'tokenizers as compact JSON tokenizers')
+
+    parser.add_argument('--input_pk', '-i', type=str, dest='input_pk',
+                        action='store',
+                        help='the input pickled keras tokenizers')
+
+    parser.add_argument('--output_json', '-o', type=str, dest='output_json',
+                        action='store',
+                        help='the output compact tokenizers')
+
+    args = parser.parse_args()
+    return args
+
+
+class CompactTokenizer:
+    '''The part of a fitted keras Tokenizer used to encode comments. It has
+    the word_index, num_words, oov_token, filters, lower and split attributes
+    of the keras Tokenizer, so it can be used with SharedTokens.get_sequences.
+
+    Parameters
+    ----------
+    words : list
+        The words of index 1, 2, ... up to num_words - 1
+    num_words : int or None
+    oov_token : str, optional
+    filters, lower, split :
+        The settings of the keras tokenizer
+    '''
+    def __init__(self, words, num_words=None, oov_token=None,
+                 filters=keras_filters, lower=True, split=' '):
+        self.words = list(words)
+        self.num_words = num_words
+        self.oov_token = oov_token
+        self.filters = filters
+        self.lower = lower
+        self.split = split
+        self.word_index = {word: i + 1 for i, word in enumerate(self.words)}
+
+    @classmethod
+    def from_keras(cls, tokenizer):
+        '''Keep the words of a keras Tokenizer with an index below
+        num_words. Words with a higher index are encoded as the oov_token, or
+        dropped without one, the same as words that were not fit.'''
+
+        num_words = tokenizer.num_words
+        words = sorted(tokenizer.word_index, key=tokenizer.word_index.get)
+        if num_words:
+            words = words[:max(num_words - 1, 0)]
+
+        if any(tokenizer.word_index[word] != i + 1
+               for i, word in enumerate(words)):
+            raise ValueError('the tokenizer word_index is not numbered '
+                             '1, 2, 3, ...')
+
+        return cls(words, num_words, tokenizer.oov_token, tokenizer.filters,
+                   tokenizer.lower, tokenizer.split)
+
+    def to_dict(self):
+        return {'words': self.words, 'num_words': self.num_words,
+                'oov_token': self.oov_token, 'filters': self.filters,
+                'lower': self.lower, 'split': self.split}
+
+    def texts_to_sequences(self, texts):
+        '''Returns the same sequences as the keras Tokenizer method'''
+
+        oov_index = self.word_index.get(self.oov_token)
+
+        sequences = []
+        for text in texts:
+            sequence = []
+            for word in text_to_word_sequence(text, self.filters, self.lower,
+                                              self.split):
+                i = self.word_index.get(word)
+                if i is not None:
+                    if self.num_words and i >= self.num_words:
+                        if oov_index is not None:
+                            sequence.append(oov_index)
+                    else:
+                        sequence.append(i)
+                elif self.oov_token is not None:
+                    sequence.append(oov_index)
+            sequences.append(sequence)
+
+        return sequences
+
+
+def save_compact_tokenizers(filepath, embed_tokenizers):
+    '''Save a dict of keras or compact tokenizers to a JSON file'''
+
+    compact = {}
+    for embed, tokenizer in embed_tokenizers.items():
+        if not isinstance(tokenizer, CompactTokenizer):
+            tokenizer = CompactTokenizer.from_keras(tokenizer)
+        compact[embed] = tokenizer.to_dict()
+
+    with open(filepath, 'w', encoding='utf-8') as handle:
+        json.dump(compact, handle, ensure_ascii=False)
+
+
+def load_tokenizers(filepath):
+    '''Load the tokenizers of each embedding as CompactTokenizers from a JSON
+    file, or unpickle the keras Tokenizers otherwise'''
+
+    if filepath.endswith('.json'):
+        with open(filepath, encoding='utf-8') as handle:
+            return {embed: CompactTokenizer(**tokenizer)
+                    for embed, tokenizer in json.load(handle).items()}
+
+    with open(filepath, 'rb') as handle:
+        return pickle.load(handle)
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    args = get_arguments()
+
+    embed_tokenizers = load_tokenizers(args.input_pk)
+    save_compact_tokenizers(args.output_json, embed_tokenizers)
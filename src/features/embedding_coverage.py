@@ -0,0 +1,204 @@
+# embedding_coverage.py
+# Author: Aaron Quinton
+# Date: 2019-07-04
+
+# This script reports how much of the comment vocabulary is covered by each
+# pretrained embedding. The comments are tokenized once and only the words of
+# each embedding file are read, not the vectors, so the report takes seconds
+# instead of loading every embedding with gensim.
+
+# USAGE:
+'''
+python src/features/embedding_coverage.py \
+--input_csv data/interim/train_2018-qualitative-data.csv \
+--input_embed_glove_crawl references/pretrained_embeddings.nosync/glove/glove.840B.300d.w2v.txt \
+--input_embed_glove_wiki references/pretrained_embeddings.nosync/glove/glove.6B.300d.w2v.txt \
+--input_embed_fasttext_crawl references/pretrained_embeddings.nosync/fasttext/crawl-300d-2M.vec \
+--output_csv data/output/embedding_coverage.csv
+'''
+
+# Import Modules
+import sys
+sys.path.insert(1, '.')
+import os
+import argparse
+import pandas as pd
+from collections import Counter
+from itertools import chain
+from src.data.preprocessing_text import preprocess_for_embed
+from src.data.preprocessing_text import get_normalizer, get_profile
+from src.features.embedding_store import EmbeddingStore
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Report the vocabulary'
+                                     'coverage of the pretrained embeddings')
+
+    parser.add_argument('--input_csv', '-i', type=str, dest='input_csv',
+                        action='store',
+                        help='the input csv file with comments')
+
+    parser.add_argument('--input_embed_glove_crawl', type=str,
+                        dest='input_embed_glove_crawl',
+                        action='store',
+                        help='the input glove crawl embed')
+
+    parser.add_argument('--input_embed_glove_wiki', type=str,
+                        dest='input_embed_glove_wiki',
+                        action='store',
+                        help='the input glove wiki embed')
+
+    parser.add_argument('--input_embed_fasttext_crawl', type=str,
+                        dest='input_embed_fasttext_crawl',
+                        action='store',
+                        help='the input glove fasttext embed')
+
+    parser.add_argument('--top_n', '-n', type=int, dest='top_n',
+                        action='store', default=10,
+                        help='number of out of vocabulary words to report')
+
+    parser.add_argument('--output_csv', '-o', type=str, dest='output_csv',
+                        action='store', default=None,
+                        help='optional output csv file for the report')
+
+    args = parser.parse_args()
+    return args
+
+
+def load_embedding_vocab(filepath):
+    '''Read the words of a text format embedding without parsing the vectors
+
+    Parameters
+    ----------
+    filepath : str
+        A word2vec or glove text format embedding, or an EmbeddingStore
+        directory
+
+    Returns
+    -------
+    vocab : set of words in the embedding
+    '''
+    if os.path.isdir(filepath):
+        return set(EmbeddingStore(filepath).words)
+
+    # Lines are split on b'\n' only, since words can contain a '\r' that
+    # universal newlines would split on
+    with open(filepath, 'rb') as handle:
+        first_line = handle.readline().split(b' ')
+        vocab = set(line.split(b' ', 1)[0].decode('utf-8', errors='ignore')
+                    for line in handle)
+
+    # word2vec files start with a "<words> <dimensions>" header
+    if len(first_line) > 2:
+        vocab.add(first_line[0].decode('utf-8', errors='ignore'))
+
+    return vocab
+
+
+def count_embed_tokens(comments, embed_names, cache=None):
+    '''Count the tokens of each embedding's preprocessing after tokenizing
+    the comments once
+
+    Parameters
+    ----------
+    comments : Pandas series object
+    embed_names : list of pretrained embedding names
+    cache : PreprocessingCache, optional
+
+    Returns
+    -------
+    counts : dict of Counter objects with an item for each embedding
+    '''
+    tokens = preprocess_for_embed(comments, 'crawl', True, cache)
+    crawl_counts = Counter(chain.from_iterable(tokens))
+
+    counts = {}
+    for embed in embed_names:
+        profile = get_profile(embed)
+        if profile == 'crawl':
+            counts[embed] = crawl_counts
+            continue
+
+        normalizer = get_normalizer(profile)
+        counts[embed] = Counter()
+        for token, count in crawl_counts.items():
+            token = normalizer.remap_token(token)
+            if token is not None:
+                counts[embed][token] += count
+
+    return counts
+
+
+def get_coverage(counts, vocab, top_n=10):
+    '''Returns the vocab coverage, text coverage and most common out of
+    vocabulary words
+
+    Parameters
+    ----------
+    counts : Counter of the comment tokens
+    vocab : set of words in the embedding
+    top_n : int
+
+    Returns
+    -------
+    vocab_coverage, text_coverage, top_oov : float, float, list of tuples
+    '''
+    in_vocab = vocab.intersection(counts)
+    known = sum(counts[word] for word in in_vocab)
+    oov = Counter({word: count for word, count in counts.items()
+                   if word not in in_vocab})
+
+    vocab_coverage = len(in_vocab) / len(counts)
+    text_coverage = known / sum(counts.values())
+
+    return vocab_coverage, text_coverage, oov.most_common(top_n)
+
+
+def get_coverage_report(comments, embedding_fnames, top_n=10, cache=None):
+    '''Builds the coverage report for every embedding
+
+    Parameters
+    ----------
+    comments : Pandas series object
+    embedding_fnames : dict of embedding file paths with an item for each
+                       embedding
+    top_n : int
+    cache : PreprocessingCache, optional
+
+    Returns
+    -------
+    report : dataframe with one row per embedding
+    '''
+    counts = count_embed_tokens(comments, list(embedding_fnames), cache)
+
+    report = []
+    for embed, filepath in embedding_fnames.items():
+        vocab = load_embedding_vocab(filepath)
+        vocab_coverage, text_coverage, top_oov = get_coverage(counts[embed],
+                                                              vocab, top_n)
+        report.append([embed, len(counts[embed]), vocab_coverage,
+                       text_coverage, top_oov])
+
+    return pd.DataFrame(report, columns=['embedding', 'comment_vocab',
+                                         'vocab_coverage', 'text_coverage',
+                                         'top_oov'])
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    args = get_arguments()
+
+    embedding_fnames = {
+        'glove_crawl': args.input_embed_glove_crawl,
+        'glove_wiki': args.input_embed_glove_wiki,
+        'fasttext_crawl': args.input_embed_fasttext_crawl}
+
+    df = pd.read_csv(args.input_csv)
+    comments = df.iloc[:, 1]
+
+    report = get_coverage_report(comments, embedding_fnames, args.top_n)
+    print(report.to_string(index=False))
+
+    if args.output_csv is not None:
+        report.to_csv(args.output_csv, index=False)
@@ -0,0 +1,222 @@
+# embedding_store.py
+# Author: Aaron Quinton
+# Date: 2019-07-09
+
+# Parsing the text format pretrained embeddings with gensim takes over an
+# hour. This script converts an embedding once to a directory with the
+# vectors as a float32 .npy matrix and a hashed index of the words. The
+# EmbeddingStore opens the directory with memory maps, so loading is almost
+# instant and processes reading the same embedding share the page cache.
+#
+# The directory holds:
+#   vectors.npy  float32 matrix with one row per word
+#   words.txt    the words in the same order, one per line
+#   offsets.npy  byte offset of each word in words.txt
+#   hashes.npy   sorted 64 bit hashes of the words
+#   rows.npy     the row of the word of each hash
+
+# USAGE:
+'''
+python src/features/embedding_store.py \
+--input_embed references/pretrained_embeddings.nosync/glove/glove.840B.300d.w2v.txt \
+--output_dir references/pretrained_embeddings.nosync/glove/glove.840B.300d
+'''
+
+# Import Modules
+import sys
+sys.path.insert(1, '.')
+import os
+import hashlib
+import argparse
+import numpy as np
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Convert a text format '
+                                     'embedding to a memory mapped store')
+
+    parser.add_argument('--input_embed', '-i', type=str, dest='input_embed',
+                        action='store',
+                        help='the input word2vec or glove text embedding')
+
+    parser.add_argument('--output_dir', '-o', type=str, dest='output_dir',
+                        action='store',
+                        help='the output directory of the store')
+
+    args = parser.parse_args()
+    return args
+
+
+def hash_word(word):
+    '''Stable 64 bit hash of a word'''
+
+    return int.from_bytes(hashlib.blake2b(word.encode('utf-8'),
+                                          digest_size=8).digest(), 'little')
+
+
+def convert_embedding(filepath, dirpath, unicode_errors='ignore',
+                      batch_size=10000):
+    '''Convert a text format embedding to an EmbeddingStore directory. The
+    vectors are written in batches so the whole embedding is never in
+    memory. Words that appear twice keep their first vector, the same as
+    KeyedVectors.load_word2vec_format.
+
+    Parameters
+    ----------
+    filepath : str
+        A word2vec text format embedding, or a glove embedding without the
+        "<words> <dimensions>" header
+    dirpath : str
+        The output directory
+
+    Returns
+    -------
+    n_words, vector_size : the shape of the vectors
+    '''
+    with open(filepath, 'rb') as handle:
+        first_line = handle.readline().split()
+        if len(first_line) == 2:
+            n_words, vector_size = int(first_line[0]), int(first_line[1])
+        else:
+            vector_size = len(first_line) - 1
+            n_words = 1 + sum(1 for line in handle)
+
+    os.makedirs(dirpath, exist_ok=True)
+    vectors = np.lib.format.open_memmap(os.path.join(dirpath, 'vectors.npy'),
+                                        mode='w+', dtype=np.float32,
+                                        shape=(n_words, vector_size))
+
+    words = []
+    with open(filepath, 'rb') as handle:
+        if len(first_line) == 2:
+            handle.readline()
+
+        batch = []
+        for line in handle:
+            parts = line.decode('utf-8', errors=unicode_errors).rstrip()\
+                        .split(' ')
+            words.append(' '.join(parts[:-vector_size]))
+            batch.append(parts[-vector_size:])
+
+            if len(batch) == batch_size:
+                start = len(words) - len(batch)
+                vectors[start:len(words)] = np.array(batch, dtype=np.float32)
+                batch = []
+
+        if batch:
+            start = len(words) - len(batch)
+            vectors[start:len(words)] = np.array(batch, dtype=np.float32)
+
+    if len(words) != n_words:
+        raise ValueError('%s has %d words, expected %d'
+                         % (filepath, len(words), n_words))
+    vectors.flush()
+    del vectors
+
+    encoded = [word.encode('utf-8') + b'\n' for word in words]
+    with open(os.path.join(dirpath, 'words.txt'), 'wb') as handle:
+        handle.writelines(encoded)
+
+    offsets = np.zeros(n_words + 1, dtype=np.int64)
+    np.cumsum([len(word) for word in encoded], out=offsets[1:])
+    np.save(os.path.join(dirpath, 'offsets.npy'), offsets)
+
+    hashes = np.array([hash_word(word) for word in words], dtype=np.uint64)
+    rows = np.argsort(hashes, kind='stable')
+    np.save(os.path.join(dirpath, 'hashes.npy'), hashes[rows])
+    np.save(os.path.join(dirpath, 'rows.npy'), rows)
+
+    return n_words, vector_size
+
+
+class EmbeddingStore:
+    '''Memory mapped pretrained embedding written by convert_embedding.
+    Words are looked up like KeyedVectors, embedding[word] returns the
+    vector and raises a KeyError for a word that is not in the embedding.
+
+    Parameters
+    ----------
+    dirpath : str
+        The directory written by convert_embedding
+    '''
+    def __init__(self, dirpath):
+        self.dirpath = dirpath
+        self.vectors = np.load(os.path.join(dirpath, 'vectors.npy'),
+                               mmap_mode='r')
+        self.offsets = np.load(os.path.join(dirpath, 'offsets.npy'),
+                               mmap_mode='r')
+        self.hashes = np.load(os.path.join(dirpath, 'hashes.npy'),
+                              mmap_mode='r')
+        self.rows = np.load(os.path.join(dirpath, 'rows.npy'), mmap_mode='r')
+        self._words = np.memmap(os.path.join(dirpath, 'words.txt'),
+                                dtype=np.uint8, mode='r')
+        self.vector_size = self.vectors.shape[1]
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def word(self, row):
+        '''Returns the word of a row of the vectors'''
+
+        start, end = self.offsets[row], self.offsets[row + 1] - 1
+        return self._words[start:end].tobytes().decode('utf-8')
+
+    @property
+    def words(self):
+        '''All of the words, in the order of the vectors'''
+
+        data = self._words.tobytes()
+        offsets = self.offsets.tolist()
+        return [data[start:end - 1].decode('utf-8')
+                for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def index(self, word):
+        '''Returns the row of a word, or None if it is not in the embedding'''
+
+        word_hash = np.uint64(hash_word(word))
+        i = np.searchsorted(self.hashes, word_hash)
+        while i < len(self.hashes) and self.hashes[i] == word_hash:
+            row = int(self.rows[i])
+            if self.word(row) == word:
+                return row
+            i += 1
+
+        return None
+
+    def __contains__(self, word):
+        return self.index(word) is not None
+
+    def __getitem__(self, word):
+        row = self.index(word)
+        if row is None:
+            raise KeyError("word '%s' not in vocabulary" % word)
+
+        return np.array(self.vectors[row])
+
+    def get(self, word, default=None):
+        row = self.index(word)
+        return default if row is None else np.array(self.vectors[row])
+
+
+def load_embedding(filepath, unicode_errors='ignore'):
+    '''Load a pretrained embedding from an EmbeddingStore directory, or parse
+    a word2vec text format file with gensim'''
+
+    if os.path.isdir(filepath):
+        return EmbeddingStore(filepath)
+
+    from gensim.models import KeyedVectors
+    return KeyedVectors.load_word2vec_format(filepath,
+                                             unicode_errors=unicode_errors,
+                                             binary=False)
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    args = get_arguments()
+
+    n_words, vector_size = convert_embedding(args.input_embed,
+                                             args.output_dir)
+    print('Wrote', n_words, 'words of', vector_size, 'dimensions to',
+          args.output_dir)
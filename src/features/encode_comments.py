@@ -3,23 +3,28 @@
 # Date: 2019-06-09
 
 # This script encodes the comments for the Keras Model to train and predict
-# Default inputs are set to encode the 2018 train comments
+# Default inputs are set to encode the 2018 train comments. With --ragged the
+# comments are saved as ragged sequences instead of padded to 700 tokens, see
+# ragged_sequences.py. The tokenizers can be the pickled keras Tokenizers or
+# the JSON file of compact_tokenizer.py, which encodes without importing keras.
 
 # For MakeFile do both usages
 # USAGE for train data:
 '''
 python src/features/encode_comments.py \
 --input_csv data/interim/train_2018-qualitative-data.csv \
---input_pk models/embed_tokenizers.pickle \
---output_pk data/processed/X_train_encoded.pickle
+--input_pk models/embed_tokenizers.json \
+--output_pk data/processed/X_train_encoded \
+--cache_db data/interim/preprocessing_cache.sqlite
 '''
 
 # USAGE for test data
 '''
 python src/features/encode_comments.py \
 --input_csv data/interim/test_2018-qualitative-data.csv \
---input_pk models/embed_tokenizers.pickle \
---output_pk data/processed/X_test_encoded.pickle
+--input_pk models/embed_tokenizers.json \
+--output_pk data/processed/X_test_encoded \
+--cache_db data/interim/preprocessing_cache.sqlite
 '''
 
 
@@ -27,11 +32,15 @@ python src/features/encode_comments.py \
 import sys
 sys.path.insert(1, '.')
 import argparse
-import pickle
-import pandas as pd
 import numpy as np
-from keras.preprocessing.sequence import pad_sequences
 from src.data.preprocessing_text import preprocess_for_embed
+from src.data.preprocessing_text import PreprocessingCache
+from src.data.stream_comments import read_comment_chunks
+from src.features.shared_tokens import SharedTokens
+from src.features.ragged_sequences import to_ragged, concat_ragged
+from src.features.ragged_sequences import pad_ragged
+from src.features.compact_tokenizer import load_tokenizers
+from src.features.array_store import save_arrays_or_pickle
 
 
 def get_arguments():
@@ -44,23 +53,62 @@ def get_arguments():
 
     parser.add_argument('--input_pk', '-i2', type=str, dest='input_pk',
                         action='store',
-                        help='the input tokenizer')
+                        help='the input tokenizers, pickled or a .json file '
+                        'of compact tokenizers')
 
     parser.add_argument('--output_pk', '-o', type=str,
                         dest='output_pk', action='store',
-                        help='the output encoded comments')
+                        help='the output encoded comments, a .pickle file '
+                        'or an array directory')
+
+    parser.add_argument('--cache_db', '-c', type=str, dest='cache_db',
+                        action='store', default=None,
+                        help='optional sqlite cache of preprocessed comments')
+
+    parser.add_argument('--chunksize', type=int, dest='chunksize',
+                        action='store', default=10000,
+                        help='number of comments read from the csv at a time')
+
+    parser.add_argument('--ragged', dest='ragged', action='store_true',
+                        default=False,
+                        help='save ragged sequences instead of padded arrays')
 
     args = parser.parse_args()
     return args
 
 
-def get_encoded_comments(comments, tokenizer, embed_name):
+def get_encoded_comments(comments, tokenizer, embed_name, cache=None,
+                         ragged=False):
+
+    comments = np.array(preprocess_for_embed(comments, embed_name, False,
+                                             cache))
+    X = to_ragged(tokenizer.texts_to_sequences(comments), maxlen=700)
+    if ragged:
+        return X
+
+    # The same array as keras pad_sequences(X, maxlen=700)
+    return pad_ragged(X, maxlen=700)
 
-    comments = np.array(preprocess_for_embed(comments, embed_name, False))
-    X = tokenizer.texts_to_sequences(comments)
-    X = pad_sequences(X, maxlen=700)
 
-    return X
+def get_all_encoded_comments(comments, embed_tokenizers, cache=None,
+                             ragged=False):
+    '''Encode comments for every embedding, preprocessing and tokenizing them
+    only once. Returns the same arrays as get_encoded_comments for each
+    embedding.'''
+
+    tokenizer = next(iter(embed_tokenizers.values()))
+    shared = SharedTokens(comments, tokenizer.filters, tokenizer.lower,
+                          tokenizer.split, cache)
+
+    encoded_comments = {}
+    for embed, tokenizer in embed_tokenizers.items():
+        X = to_ragged(shared.get_sequences(tokenizer, embed), maxlen=700)
+        if ragged:
+            encoded_comments[embed] = X
+        else:
+            encoded_comments[embed] = pad_ragged(X, maxlen=700)
+
+    return encoded_comments
 
 
 ###############################################################################
@@ -68,19 +116,28 @@ if __name__ == "__main__":
 
     args = get_arguments()
     embed_names = ['glove_crawl', 'glove_wiki', 'fasttext_crawl']
-    df = pd.read_csv(args.input_csv)
-    comments = df.iloc[:, 1]
 
     # Load Tokenizers
-    with open(args.input_pk, 'rb') as handle:
-        embed_tokenizers = pickle.load(handle)
+    embed_tokenizers = load_tokenizers(args.input_pk)
 
     # Encode Comments and save processed data for model training
+    # The csv is read in chunks and each chunk is encoded for every embedding
+    cache = PreprocessingCache(args.cache_db)
+    embed_tokenizers = {embed: embed_tokenizers[embed]
+                        for embed in embed_names}
+    encoded_chunks = {embed: [] for embed in embed_names}
+    for _, comments in read_comment_chunks(args.input_csv, args.chunksize):
+        encoded = get_all_encoded_comments(comments, embed_tokenizers, cache,
+                                           args.ragged)
+        for embed in embed_names:
+            encoded_chunks[embed].append(encoded[embed])
+    cache.close()
+
     encoded_comments = {}
     for embed in embed_names:
-        encoded_comments[embed] = get_encoded_comments(comments,
-                                                       embed_tokenizers[embed],
-                                                       embed)
+        if args.ragged:
+            encoded_comments[embed] = concat_ragged(encoded_chunks[embed])
+        else:
+            encoded_comments[embed] = np.vstack(encoded_chunks[embed])
 
-    with open(args.output_pk, 'wb') as handle:
-        pickle.dump(encoded_comments, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    save_arrays_or_pickle(args.output_pk, encoded_comments)
@@ -6,7 +6,13 @@
 # Keras deep learning models. It saves a dictionary of tokenizers and a
 # dictionary of arrays with an item for each embedding. These are saved in the
 # models folder. To run this script you need to have the required pretrained
-# embeddings in the reference folder. See Readme for more details
+# embeddings in the reference folder. See Readme for more details. The
+# embeddings can be text files or directories written by embedding_store.py,
+# which load in seconds instead of parsing the text. Text files are streamed
+# and only the vectors of the tokenizer's words are kept. With --n_jobs the
+# three embedding matrices are built in parallel processes. With
+# --output_json the tokenizers are also saved as compact tokenizers, see
+# compact_tokenizer.py.
 
 # USAGE:
 '''
@@ -16,19 +22,28 @@ python src/features/keras_embeddings.py \
 --input_embed_glove_wiki references/pretrained_embeddings.nosync/glove/glove.6B.300d.w2v.txt \
 --input_embed_fasttext_crawl references/pretrained_embeddings.nosync/fasttext/crawl-300d-2M.vec \
 --output_pk1 models/embed_tokenizers.pickle \
---output_pk2 models/embed_matrices.pickle
+--output_pk2 models/embed_matrices \
+--output_json models/embed_tokenizers.json \
+--cache_db data/interim/preprocessing_cache.sqlite
 '''
 
 # Import Modules
 import sys
 sys.path.insert(1, '.')
+import os
+import time
 import pickle
 import argparse
-import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from src.data.preprocessing_text import preprocess_for_embed
+from src.data.preprocessing_text import PreprocessingCache
+from src.data.stream_comments import read_comment_chunks
+from src.features.shared_tokens import SharedTokens
+from src.features.embedding_store import load_embedding
+from src.features.array_store import save_arrays_or_pickle
+from src.features.compact_tokenizer import save_compact_tokenizers
 from keras.preprocessing.text import Tokenizer
-from gensim.models import KeyedVectors
 
 
 def get_arguments():
@@ -42,17 +57,17 @@ def get_arguments():
     parser.add_argument('--input_embed_glove_crawl', type=str,
                         dest='input_embed_glove_crawl',
                         action='store',
-                        help='the input glove crawl embed')
+                        help='the input glove crawl embed file or store')
 
     parser.add_argument('--input_embed_glove_wiki', type=str,
                         dest='input_embed_glove_wiki',
                         action='store',
-                        help='the input glove wiki embed')
+                        help='the input glove wiki embed file or store')
 
     parser.add_argument('--input_embed_fasttext_crawl', type=str,
                         dest='input_embed_fasttext_crawl',
                         action='store',
-                        help='the input glove fasttext embed')
+                        help='the input glove fasttext embed file or store')
 
     parser.add_argument('--output_pk1', '-o1', type=str,
                         dest='output_pk1', action='store',
@@ -60,21 +75,55 @@ def get_arguments():
 
     parser.add_argument('--output_pk2', '-o2', type=str,
                         dest='output_pk2', action='store',
-                        help='the output embed matrix')
+                        help='the output embed matrix, a .pickle file or an '
+                        'array directory')
+
+    parser.add_argument('--output_json', '-o3', type=str,
+                        dest='output_json', action='store', default=None,
+                        help='optional output compact tokenizers')
+
+    parser.add_argument('--cache_db', '-c', type=str, dest='cache_db',
+                        action='store', default=None,
+                        help='optional sqlite cache of preprocessed comments')
+
+    parser.add_argument('--chunksize', type=int, dest='chunksize',
+                        action='store', default=10000,
+                        help='number of comments read from the csv at a time')
+
+    parser.add_argument('--n_jobs', '-j', type=int, dest='n_jobs',
+                        action='store', default=1,
+                        help='number of embedding matrices built at once')
 
     args = parser.parse_args()
     return args
 
 
-def get_embed_tokenizer(comments, embed_name, max_words=12000):
+def get_embed_tokenizer(comments, embed_name, max_words=12000, cache=None):
 
-    comments = np.array(preprocess_for_embed(comments, embed_name, False))
+    comments = np.array(preprocess_for_embed(comments, embed_name, False,
+                                             cache))
     tokenizer = Tokenizer(num_words=max_words)
     tokenizer.fit_on_texts(comments)
 
     return tokenizer
 
 
+def fit_embed_tokenizers(chunks, embed_names, max_words=12000, cache=None):
+    '''Fit a tokenizer for each embedding on chunks of comments from
+    read_comment_chunks, one chunk at a time. Each chunk is preprocessed and
+    tokenized once for all the embeddings.'''
+
+    embed_tokenizers = {embed: Tokenizer(num_words=max_words)
+                        for embed in embed_names}
+
+    for _, comments in chunks:
+        shared = SharedTokens(comments, cache=cache)
+        for embed in embed_names:
+            embed_tokenizers[embed].fit_on_texts(shared.get_tokens(embed))
+
+    return embed_tokenizers
+
+
 def get_embed_matrix(embed_index, tokenizer, embed_size=300, max_words=12000):
 
     word_index = tokenizer.word_index
@@ -97,6 +146,98 @@ def get_embed_matrix(embed_index, tokenizer, embed_size=300, max_words=12000):
     return embedding_matrix
 
 
+def get_embed_matrix_from_file(filepath, tokenizer, embed_size=300,
+                               max_words=12000, unicode_errors='ignore'):
+    '''Build the same matrix as get_embed_matrix by streaming a text format
+    embedding, without loading it. Only the lines of words in the tokenizer
+    are parsed and reading stops once every word has been found, so the
+    peak memory is about the size of the matrix.
+
+    Parameters
+    ----------
+    filepath : str
+        A word2vec or glove text format embedding
+    tokenizer : a fitted keras Tokenizer
+
+    Returns
+    -------
+    embedding_matrix : float32 array of (num_words, embed_size)
+    '''
+    word_index = tokenizer.word_index
+    num_words = min(max_words, len(word_index) + 1)
+    embedding_matrix = np.zeros((num_words, embed_size), dtype='float32')
+
+    needed = {word: i for word, i in word_index.items() if i < max_words}
+
+    with open(filepath, 'rb') as handle:
+        for line in handle:
+            if not needed:
+                break
+
+            word = line.split(b' ', 1)[0].decode('utf-8',
+                                                  errors=unicode_errors)
+            if word not in needed:
+                continue
+
+            parts = line.rstrip().split(b' ')
+            # Skips the word2vec header and words that contain spaces
+            if len(parts) != embed_size + 1:
+                continue
+
+            # The first vector of a word is kept, as in KeyedVectors
+            embedding_matrix[needed.pop(word)] = np.array(parts[1:],
+                                                          dtype='float32')
+
+    return embedding_matrix
+
+
+def build_embed_matrix(filepath, tokenizer, embed_size=300, max_words=12000):
+    '''Build an embedding matrix from an EmbeddingStore directory or by
+    streaming a text format embedding'''
+
+    if os.path.isdir(filepath):
+        return get_embed_matrix(load_embedding(filepath), tokenizer,
+                                embed_size, max_words)
+
+    return get_embed_matrix_from_file(filepath, tokenizer, embed_size,
+                                      max_words)
+
+
+def _timed_embed_matrix(filepath, tokenizer):
+    start = time.perf_counter()
+    embed_matrix = build_embed_matrix(filepath, tokenizer)
+
+    return embed_matrix, time.perf_counter() - start
+
+
+def build_embed_matrices(embedding_fnames, embed_tokenizers, n_jobs=1):
+    '''Build the embedding matrix of every embedding, in a pool of n_jobs
+    processes when n_jobs > 1. The matrices do not depend on each other and
+    reading each embedding is I/O and parse bound.
+
+    Returns
+    -------
+    embed_matrices : dict of arrays with an item for each embedding
+    seconds : dict of the time taken to build each matrix
+    '''
+    embed_names = list(embedding_fnames)
+    args = ([embedding_fnames[embed] for embed in embed_names],
+            [embed_tokenizers[embed] for embed in embed_names])
+
+    if n_jobs == 1:
+        results = list(map(_timed_embed_matrix, *args))
+    else:
+        with ProcessPoolExecutor(min(n_jobs, len(embed_names))) as executor:
+            results = list(executor.map(_timed_embed_matrix, *args))
+
+    embed_matrices = {embed: matrix
+                      for embed, (matrix, _) in zip(embed_names, results)}
+    seconds = {embed: seconds
+               for embed, (_, seconds) in zip(embed_names, results)}
+
+    return embed_matrices, seconds
+
+
 ###############################################################################
 if __name__ == "__main__":
 
@@ -110,33 +251,30 @@ if __name__ == "__main__":
 
     embed_names = ['glove_crawl', 'glove_wiki', 'fasttext_crawl']
 
-    df = pd.read_csv(args.input_csv)
-    comments = df.iloc[:, 1]
-
     # Get and save tokenizers for each embedding
     # Preprocessing the comments is different depending on the embedding, which
     # is why there are different tokenizers
-    embed_tokenizers = {}
-    for embed in embed_names:
-        embed_tokenizers[embed] = get_embed_tokenizer(comments, embed)
+    # The comments are tokenized once for all three tokenizers, see
+    # shared_tokens.py, so fitting them is not split across processes
+    start = time.perf_counter()
+    cache = PreprocessingCache(args.cache_db)
+    chunks = read_comment_chunks(args.input_csv, args.chunksize)
+    embed_tokenizers = fit_embed_tokenizers(chunks, embed_names, cache=cache)
+    cache.close()
+    print('Fit tokenizers in %.1f seconds' % (time.perf_counter() - start))
 
     with open(args.output_pk1, 'wb') as handle:
         pickle.dump(embed_tokenizers, handle, protocol=pickle.HIGHEST_PROTOCOL)
 
-    # Load pretrained embeddings
-    embed_indices = {}
-    for embed in embedding_fnames.keys():
-        print('Loading pretrained embedding for', embed)
-        embed_indices[embed] = KeyedVectors.load_word2vec_format(
-                                    embedding_fnames[embed],
-                                    unicode_errors='ignore',
-                                    binary=False)
+    if args.output_json is not None:
+        save_compact_tokenizers(args.output_json, embed_tokenizers)
 
     # Get and save the embedding matrix for each embedding
-    embed_matrices = {}
-    for embed in embedding_fnames.keys():
-        embed_matrices[embed] = get_embed_matrix(embed_indices[embed],
-                                                 embed_tokenizers[embed])
+    embed_matrices, seconds = build_embed_matrices(embedding_fnames,
+                                                   embed_tokenizers,
+                                                   args.n_jobs)
+    for embed in embed_names:
+        print('Built embedding matrix for %s in %.1f seconds'
+              % (embed, seconds[embed]))
 
-    with open(args.output_pk2, 'wb') as handle:
-        pickle.dump(embed_matrices, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    save_arrays_or_pickle(args.output_pk2, embed_matrices)
@@ -0,0 +1,209 @@
+# ragged_sequences.py
+# Author: Aaron Quinton
+# Date: 2019-07-11
+
+# Most comments are a few dozen words, so padding every comment to 700 tokens
+# leaves the encoded arrays and the models' inputs almost all zeros. This
+# module stores encoded comments as ragged sequences, one flat array of
+# token indices with the offset of each comment, and pads them one batch at a
+# time. Batches are built from comments of similar length so each batch is
+# only padded to its own longest comment.
+#
+# Padding and truncating are 'pre', the same as keras pad_sequences, so a
+# ragged encoding padded to 700 is identical to the fixed encoding. Batches
+# are padded with at least 2 zeros in front of every comment, so the masked
+# pooling of the models sees the same windows of a comment in any batch, see
+# masked_pooling.py.
+
+# Import Modules
+from itertools import chain
+import numpy as np
+from src.data.preprocessing_text import get_random_state
+
+
+def to_ragged(sequences, maxlen=700):
+    '''Store lists of token indices as a ragged encoding, keeping the last
+    maxlen tokens of each comment like pad_sequences
+
+    Parameters
+    ----------
+    sequences : list of lists of token indices
+    maxlen : int or None
+
+    Returns
+    -------
+    ragged : dict with the flat 'values' and the 'offsets' of each comment
+    '''
+    if maxlen is not None:
+        sequences = [sequence[-maxlen:] for sequence in sequences]
+
+    offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+    np.cumsum([len(sequence) for sequence in sequences], out=offsets[1:])
+    values = np.fromiter(chain.from_iterable(sequences), dtype=np.int32,
+                         count=offsets[-1])
+
+    return {'values': values, 'offsets': offsets}
+
+
+def is_ragged(X):
+    return isinstance(X, dict) and 'offsets' in X
+
+
+def ragged_lengths(X):
+    return np.diff(X['offsets'])
+
+
+def concat_ragged(chunks):
+    '''Join ragged encodings, for example of the chunks of a csv'''
+
+    chunks = list(chunks)
+    lengths = np.concatenate([ragged_lengths(X) for X in chunks])
+
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    return {'values': np.concatenate([X['values'] for X in chunks]),
+            'offsets': offsets}
+
+
+def slice_ragged(X, start, stop):
+    '''Returns the comments from start to stop of a ragged encoding'''
+
+    offsets = X['offsets'][start:stop + 1]
+
+    return {'values': X['values'][offsets[0]:offsets[-1]],
+            'offsets': offsets - offsets[0]}
+
+
+def pad_ragged(X, index=None, maxlen=None, min_len=1, min_padding=0):
+    '''Pad the comments of a ragged encoding into an array
+
+    Parameters
+    ----------
+    X : ragged encoding
+    index : array of the comments to pad, all of them by default
+    maxlen : int, optional
+        The padded length. By default the length of the longest comment in
+        index plus min_padding, and at least min_len.
+
+    Returns
+    -------
+    padded : int32 array of shape (len(index), maxlen)
+    '''
+    values, offsets = X['values'], X['offsets']
+    if index is None:
+        index = np.arange(len(offsets) - 1)
+
+    if maxlen is None:
+        lengths = offsets[np.asarray(index) + 1] - offsets[index]
+        maxlen = max((int(lengths.max()) if len(lengths) else 0)
+                     + min_padding, min_len)
+
+    padded = np.zeros((len(index), maxlen), dtype=np.int32)
+    for row, i in enumerate(index):
+        sequence = values[offsets[i]:offsets[i + 1]][-maxlen:]
+        padded[row, maxlen - len(sequence):] = sequence
+
+    return padded
+
+
+def get_bucketed_indices(lengths, batch_size=128, shuffle=True,
+                         random_state=None):
+    '''Split the comments into batches of similar length
+
+    Parameters
+    ----------
+    lengths : array with the number of tokens of each comment
+    batch_size : int
+    shuffle : bool
+        Shuffle comments of the same length and the order of the batches
+    random_state : int or numpy RandomState, optional
+
+    Returns
+    -------
+    batches : list of arrays of comment indices
+    '''
+    if shuffle:
+        rng = get_random_state(random_state)
+        index = rng.permutation(len(lengths))
+        index = index[np.argsort(lengths[index], kind='stable')]
+    else:
+        index = np.argsort(lengths, kind='stable')
+
+    batches = [index[start:start + batch_size]
+               for start in range(0, len(index), batch_size)]
+    if shuffle:
+        rng.shuffle(batches)
+
+    return batches
+
+
+def bucketed_steps_per_epoch(X, batch_size=128):
+    '''Returns the number of batches bucketed_batches yields per epoch'''
+
+    return int(np.ceil((len(X['offsets']) - 1) / batch_size))
+
+
+def bucketed_batches(X, Y, batch_size=128, shuffle=True, random_state=None,
+                     min_len=3, min_padding=2):
+    '''Yields length bucketed minibatches indefinitely, for Keras
+    fit_generator with steps_per_epoch=bucketed_steps_per_epoch(X,
+    batch_size). Each batch is padded to its longest comment plus
+    min_padding.
+
+    Parameters
+    ----------
+    X : ragged encoding
+    Y : numpy array with comment labels
+    min_len : int
+        The shortest padded length, at least the kernel size of the
+        convolutions
+    min_padding : int
+        The fewest zeros in front of a comment, kernel size - 1 so the
+        windows that end on its first tokens are the same in every batch
+
+    Yields
+    ------
+    X_batch, Y_batch : numpy arrays
+    '''
+    rng = get_random_state(random_state)
+    lengths = ragged_lengths(X)
+
+    while True:
+        for batch in get_bucketed_indices(lengths, batch_size, shuffle, rng):
+            yield pad_ragged(X, batch, min_len=min_len,
+                             min_padding=min_padding), Y[batch]
+
+
+def predict_sequences(model, X, batch_size=128, min_len=3, min_padding=2):
+    '''Predict encoded comments with a Keras model. Ragged encodings are
+    predicted in length bucketed batches when the model takes sequences of
+    any length, and are padded to the model's input length otherwise.
+
+    Parameters
+    ----------
+    model : Keras model
+    X : padded array or ragged encoding
+
+    Returns
+    -------
+    Y_pred : numpy array of predictions in the order of the comments
+    '''
+    if not is_ragged(X):
+        return model.predict(X)
+
+    maxlen = model.input_shape[1]
+    if maxlen is not None:
+        return model.predict(pad_ragged(X, maxlen=maxlen))
+
+    Y_pred = None
+    for batch in get_bucketed_indices(ragged_lengths(X), batch_size,
+                                      shuffle=False):
+        pred = model.predict_on_batch(pad_ragged(X, batch, min_len=min_len,
+                                                 min_padding=min_padding))
+        if Y_pred is None:
+            Y_pred = np.zeros((len(X['offsets']) - 1, pred.shape[1]),
+                              dtype=pred.dtype)
+        Y_pred[batch] = pred
+
+    return Y_pred
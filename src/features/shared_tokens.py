@@ -0,0 +1,123 @@
+# shared_tokens.py
+# Author: Aaron Quinton
+# Date: 2019-07-05
+
+# The glove_crawl, glove_wiki and fasttext_crawl tokenizers only see different
+# text where numbers are masked for glove_wiki. This module preprocesses and
+# tokenizes the comments once with the 'crawl' profile, stores the tokens as
+# integer ids into a shared vocabulary, and derives each embedding's tokens
+# and tokenizer sequences through a small remap table over that vocabulary.
+
+# Import Modules
+import re
+from src.data.preprocessing_text import preprocess_for_embed, clean_numbers
+from src.data.preprocessing_text import get_normalizer, get_profile
+
+# Default settings of keras.preprocessing.text.Tokenizer
+keras_filters = '!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n'
+
+
+def text_to_word_sequence(text, filters=keras_filters, lower=True,
+                          split=' '):
+    '''Split a string into words the same way as the keras function of the
+    same name, without importing keras'''
+
+    if lower:
+        text = text.lower()
+    text = text.translate(str.maketrans({char: split for char in filters}))
+
+    return [word for word in text.split(split) if word]
+
+
+class SharedTokens:
+    '''Comments tokenized once for every pretrained embedding
+
+    Parameters
+    ----------
+    comments : Pandas series object
+    filters, lower, split :
+        The settings of the keras tokenizers, which all use the defaults
+    cache : PreprocessingCache, optional
+    '''
+    def __init__(self, comments, filters=keras_filters, lower=True,
+                 split=' ', cache=None):
+        self.filters = filters
+        self.lower = lower
+
+        self.vocab = {}
+        self.sequences = []
+        for text in preprocess_for_embed(comments, 'crawl', False, cache):
+            self.sequences.append([
+                self.vocab.setdefault(word, len(self.vocab))
+                for word in text_to_word_sequence(text, filters, lower,
+                                                  split)])
+        self.words = list(self.vocab)
+
+    def get_remap_table(self, embed_name):
+        '''Returns the words of an embedding's preprocessing for each word id
+        of the shared vocabulary'''
+
+        normalizer = get_normalizer(get_profile(embed_name))
+
+        table = []
+        for word in self.words:
+            if normalizer.numbers and '#' in self.filters:
+                # Masked numbers are dropped by the tokenizer as '#' is a
+                # filter, which splits the word around them
+                words = [part for part in re.split('[0-9]{2,}', word)
+                         if part]
+            elif normalizer.numbers:
+                words = [clean_numbers(word)]
+            else:
+                words = [word]
+
+            if normalizer.lower:
+                words = [word.lower() for word in words]
+            table.append(words)
+
+        return table
+
+    def get_tokens(self, embed_name):
+        '''Returns the list of words for each comment as tokenized for an
+        embedding. These can be passed to Tokenizer.fit_on_texts.'''
+
+        table = self.get_remap_table(embed_name)
+
+        return [[word for i in sequence for word in table[i]]
+                for sequence in self.sequences]
+
+    def get_sequences(self, tokenizer, embed_name):
+        '''Returns the same sequences as tokenizer.texts_to_sequences on the
+        comments preprocessed for an embedding
+
+        Parameters
+        ----------
+        tokenizer : a fitted keras Tokenizer
+        embed_name : str
+
+        Returns
+        -------
+        sequences : list of lists of word indices
+        '''
+        num_words = tokenizer.num_words
+        oov_index = tokenizer.word_index.get(tokenizer.oov_token)
+
+        # Word ids are mapped to tokenizer indices once, with the same rules
+        # as texts_to_sequences
+        table = []
+        for words in self.get_remap_table(embed_name):
+            indices = []
+            for word in words:
+                i = tokenizer.word_index.get(word)
+                if i is not None:
+                    if num_words and i >= num_words:
+                        if oov_index is not None:
+                            indices.append(oov_index)
+                    else:
+                        indices.append(i)
+                elif tokenizer.oov_token is not None:
+                    indices.append(oov_index)
+            table.append(indices)
+
+        return [[index for i in sequence for index in table[i]]
+                for sequence in self.sequences]
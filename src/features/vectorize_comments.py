@@ -2,7 +2,11 @@
 # Author: Fan Nie, Ayla Pearson, Aaron Quinton
 # Date: 2019-06-11
 
-# This script vectorizes comments for later training
+# This script vectorizes comments for later training. With --output_shards
+# the comments are transformed in chunks by a pool of processes and each
+# chunk is saved as a sparse npz shard, listed in order in a manifest.json.
+# load_vectorized and iter_vectorized read either a single npz file or a
+# shard directory.
 
 # For MakeFile do both usages
 # USAGE for train data:
@@ -10,7 +14,8 @@
 python src/features/vectorize_comments.py \
 --input_csv data/interim/train_2018-qualitative-data.csv \
 --input_pk models/bow_vectorizer.pickle \
---output_npz data/processed/X_train_bow.npz
+--output_npz data/processed/X_train_bow.npz \
+--cache_db data/interim/preprocessing_cache.sqlite
 '''
 
 # USAGE for test data
@@ -18,17 +23,32 @@ python src/features/vectorize_comments.py \
 python src/features/vectorize_comments.py \
 --input_csv data/interim/test_2018-qualitative-data.csv \
 --input_pk models/bow_vectorizer.pickle \
---output_npz data/processed/X_test_bow.npz
+--output_npz data/processed/X_test_bow.npz \
+--cache_db data/interim/preprocessing_cache.sqlite
+'''
+
+# USAGE for sharded output
+'''
+python src/features/vectorize_comments.py \
+--input_csv data/interim/train_2018-qualitative-data.csv \
+--input_pk models/bow_vectorizer.pickle \
+--output_shards data/processed/X_train_bow \
+--cache_db data/interim/preprocessing_cache.sqlite \
+--n_jobs 4
 '''
 
 # Import modules
 import sys
 sys.path.insert(1, '.')
-import pandas as pd
 from src.data.preprocessing_text import preprocess_for_bow
+from src.data.preprocessing_text import PreprocessingCache
+from src.data.stream_comments import preprocess_comment_chunks
+import os
+import json
 import pickle
 import argparse
 import scipy.sparse
+from concurrent.futures import ProcessPoolExecutor
 
 # Default File paths:
 filepath_in = './data/interim/train_2018-qualitative-data.csv'
@@ -51,29 +71,138 @@ def get_arguments():
                         dest='output_npz', action='store',
                         default=filepath_out, help='the output npz file')
 
+    parser.add_argument('--cache_db', '-c', type=str, dest='cache_db',
+                        action='store', default=None,
+                        help='optional sqlite cache of preprocessed comments')
+
+    parser.add_argument('--chunksize', type=int, dest='chunksize',
+                        action='store', default=10000,
+                        help='number of comments read from the csv at a time')
+
+    parser.add_argument('--output_shards', '-s', type=str,
+                        dest='output_shards', action='store', default=None,
+                        help='optional directory to write npz shards to '
+                        'instead of one npz file')
+
+    parser.add_argument('--n_jobs', '-j', type=int, dest='n_jobs',
+                        action='store', default=1,
+                        help='number of processes transforming the shards')
+
     args = parser.parse_args()
     return args
 
 
-def get_vectorized_comments(comments, vectorizer):
+def get_vectorized_comments(comments, vectorizer, cache=None):
 
-    comments = preprocess_for_bow(comments)
+    comments = preprocess_for_bow(comments, cache)
     X = vectorizer.transform(comments)
 
     return X
 
 
+def get_vectorized_chunks(chunks, vectorizer):
+    '''Transform chunks of preprocessed comments from
+    preprocess_comment_chunks and stack them into one sparse matrix'''
+
+    X = [vectorizer.transform(texts) for _, texts, _ in chunks]
+
+    return scipy.sparse.vstack(X, format='csr')
+
+
+_vectorizer = None
+
+
+def _set_vectorizer(vectorizer):
+    # Each worker unpickles the vectorizer once instead of once per shard
+    global _vectorizer
+    _vectorizer = vectorizer
+
+
+def _write_shard(texts, filepath):
+    X = _vectorizer.transform(texts)
+    scipy.sparse.save_npz(filepath, X.tocsr())
+
+    return X.shape
+
+
+def write_vectorized_shards(chunks, vectorizer, dirpath, n_jobs=1):
+    '''Transform chunks of preprocessed comments from
+    preprocess_comment_chunks in a pool of processes and save each chunk as
+    an npz shard. At most 2 * n_jobs chunks are held in memory at a time.
+
+    Returns
+    -------
+    manifest : dict with the shard files in order and the total shape, also
+               saved as manifest.json in dirpath
+    '''
+    os.makedirs(dirpath, exist_ok=True)
+
+    shapes = []
+    with ProcessPoolExecutor(n_jobs, initializer=_set_vectorizer,
+                             initargs=(vectorizer,)) as executor:
+        futures = []
+        for i, (_, texts, _) in enumerate(chunks):
+            filename = 'shard_%05d.npz' % i
+            futures.append((filename, executor.submit(
+                _write_shard, list(texts), os.path.join(dirpath, filename))))
+
+            while len(futures) >= 2 * n_jobs:
+                filename, future = futures.pop(0)
+                shapes.append((filename, future.result()))
+
+        for filename, future in futures:
+            shapes.append((filename, future.result()))
+
+    manifest = {'shards': [{'file': filename, 'rows': shape[0]}
+                           for filename, shape in shapes],
+                'rows': sum(shape[0] for _, shape in shapes),
+                'columns': shapes[0][1][1] if shapes else 0}
+
+    with open(os.path.join(dirpath, 'manifest.json'), 'w') as handle:
+        json.dump(manifest, handle, indent=2)
+
+    return manifest
+
+
+def iter_vectorized(filepath):
+    '''Yield the sparse matrices of a shard directory in order, or the
+    matrix of a single npz file'''
+
+    if not os.path.isdir(filepath):
+        yield scipy.sparse.load_npz(filepath)
+        return
+
+    with open(os.path.join(filepath, 'manifest.json')) as handle:
+        manifest = json.load(handle)
+
+    for shard in manifest['shards']:
+        yield scipy.sparse.load_npz(os.path.join(filepath, shard['file']))
+
+
+def load_vectorized(filepath):
+    '''Load a single npz file, or stack the shards of a shard directory'''
+
+    return scipy.sparse.vstack(list(iter_vectorized(filepath)), format='csr')
+
+
 ###############################################################################
 if __name__ == "__main__":
 
     args = get_arguments()
-    df = pd.read_csv(args.input_csv)
-    comments = df.iloc[:, 1]
-
     # Load Vectorizer
     with open(args.input_pk, 'rb') as handle:
         bow_vectorizer = pickle.load(handle)
 
     # Get sparse document-term matrix and save
-    X = get_vectorized_comments(comments, bow_vectorizer)
+    cache = PreprocessingCache(args.cache_db)
+    chunks = preprocess_comment_chunks(args.input_csv, 'bow', args.chunksize,
+                                       cache, tokenize=False)
+    if args.output_shards is not None:
+        write_vectorized_shards(chunks, bow_vectorizer, args.output_shards,
+                                args.n_jobs)
+        cache.close()
+        sys.exit()
+
+    X = get_vectorized_chunks(chunks, bow_vectorizer)
+    cache.close()
     scipy.sparse.save_npz(args.output_npz, X)
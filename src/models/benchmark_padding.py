@@ -0,0 +1,112 @@
+# benchmark_padding.py
+# Author: Aaron Quinton
+# Date: 2019-07-11
+
+# This script times predicting the encoded test comments with the conv1d and
+# biGRU architectures, once with every comment padded to 700 tokens and once
+# with length bucketed batches padded to their longest comment. The models
+# are untrained as the throughput does not depend on the weights. Padded
+# encodings are converted to ragged sequences by dropping the zeros, since 0
+# is never a token index.
+
+# USAGE:
+'''
+python src/models/benchmark_padding.py \
+--input_pk1 models/embed_matrices \
+--input_pk2 data/processed/X_test_encoded
+'''
+
+# Import Modules
+import sys
+sys.path.insert(1, '.')
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from src.features.ragged_sequences import is_ragged, to_ragged, pad_ragged
+from src.features.ragged_sequences import ragged_lengths, predict_sequences
+from src.models.conv1d import build_conv1d
+from src.models.biGRU import build_biGRU
+from src.features.array_store import load_arrays
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark fixed and length'
+                                     'bucketed padding')
+
+    parser.add_argument('--input_pk1', '-i', type=str, dest='input_pk1',
+                        action='store', default=None,
+                        help='optional input embedding matrices, random '
+                        'matrices are used otherwise')
+
+    parser.add_argument('--input_pk2', '-i2', type=str, dest='input_pk2',
+                        action='store',
+                        help='input encoded test comments')
+
+    parser.add_argument('--batch_size', '-b', type=int, dest='batch_size',
+                        action='store', default=128,
+                        help='number of comments predicted at a time')
+
+    args = parser.parse_args()
+    return args
+
+
+def benchmark_padding(X, embed_matrix, batch_size=128):
+    '''Time the conv1d and biGRU predictions with fixed and bucketed padding
+
+    Returns
+    -------
+    results : dataframe with the seconds and comments per second of each
+              model and padding
+    '''
+    if not is_ragged(X):
+        X = to_ragged([row[row != 0] for row in X])
+
+    n_comments = len(X['offsets']) - 1
+    X_padded = pad_ragged(X, maxlen=700)
+
+    results = []
+    for name, build in [('conv1d', build_conv1d), ('biGRU', build_biGRU)]:
+        fixed = build(embed_matrix, maxlen=700)
+        start = time.perf_counter()
+        fixed.predict(X_padded, batch_size=batch_size)
+        fixed_s = time.perf_counter() - start
+
+        bucketed = build(embed_matrix, maxlen=None)
+        bucketed.set_weights(fixed.get_weights())
+        start = time.perf_counter()
+        predict_sequences(bucketed, X, batch_size)
+        bucketed_s = time.perf_counter() - start
+
+        results.append([name, 'fixed', fixed_s, n_comments / fixed_s])
+        results.append([name, 'bucketed', bucketed_s,
+                        n_comments / bucketed_s])
+
+    results = pd.DataFrame(results, columns=['model', 'padding', 'seconds',
+                                             'comments_per_s'])
+    return results.round(3)
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    args = get_arguments()
+
+    X = load_arrays(args.input_pk2, ['glove_wiki'])['glove_wiki']
+
+    if args.input_pk1 is not None:
+        embed_matrix = load_arrays(args.input_pk1,
+                                   ['glove_wiki'])['glove_wiki']
+    else:
+        embed_matrix = np.random.RandomState(2019).normal(
+            size=(12000, 300)).astype('float32')
+
+    if not is_ragged(X):
+        X = to_ragged([row[row != 0] for row in X])
+    lengths = ragged_lengths(X)
+    print('Comments:', len(lengths), 'mean tokens:', round(lengths.mean(), 1),
+          'padding with maxlen 700:',
+          round(1 - lengths.sum() / (700 * len(lengths)), 3))
+
+    print(benchmark_padding(X, embed_matrix, args.batch_size)
+          .to_string(index=False))
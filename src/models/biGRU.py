@@ -3,21 +3,28 @@
 # Date: 2019-06-10
 
 # This script defines a function that trains a Bidirectional GRU neural net for
-# each embedding and saves it in the models folder.
+# each embedding and saves it in the models folder. If the encoded comments
+# are ragged, see encode_comments.py --ragged, the models take sequences of
+# any length and are trained on length bucketed batches. With --balance the
+# models are trained on minibatches oversampled to balance the themes, see
+# balanced_batches in preprocessing_text.py. With --embed_dir the models are
+# saved without their frozen embedding weights, see packed_models.py.
 
 # USAGE:
 '''
 python src/models/biGRU.py \
 --input_csv data/interim/train_2018-qualitative-data.csv \
---input_pk1 models/embed_matrices.pickle \
---input_pk2 data/processed/X_train_encoded.pickle \
+--input_pk1 models/embed_matrices \
+--input_pk2 data/processed/X_train_encoded \
 --output1_h5 models/biGRU_glove_crawl.h5 \
 --output2_h5 models/biGRU_glove_wiki.h5 \
---output3_h5 models/biGRU_fasttext_crawl.h5
+--output3_h5 models/biGRU_fasttext_crawl.h5 \
+--embed_dir models/embeddings
 '''
 
 # Import Modules
-import pickle
+import sys
+sys.path.insert(1, '.')
 import pandas as pd
 import numpy as np
 from keras.layers import Dense, Input, Embedding
@@ -26,8 +33,15 @@ from keras.layers import GlobalMaxPooling1D, GlobalAveragePooling1D
 from keras.layers import GRU, concatenate
 from keras.models import Model
 from keras import backend as K
-K.set_learning_phase(1)
 import argparse
+from src.features.ragged_sequences import is_ragged, slice_ragged
+from src.features.ragged_sequences import bucketed_batches
+from src.features.ragged_sequences import bucketed_steps_per_epoch
+from src.features.array_store import load_arrays
+from src.data.preprocessing_text import balanced_batches
+from src.data.preprocessing_text import balanced_steps_per_epoch
+from src.models.packed_models import save_packed_model
+from src.models.masked_pooling import RemoveMask, MaskedGlobalPooling1D
 
 
 def get_arguments():
@@ -39,11 +53,13 @@ def get_arguments():
 
     parser.add_argument('--input_pk1', '-i2', type=str, dest='input_pk1',
                         action='store',
-                        help='the input embedding_matrix')
+                        help='the input embedding_matrix array directory or '
+                        'pickle')
 
     parser.add_argument('--input_pk2', '-i3', type=str, dest='input_pk2',
                         action='store',
-                        help='input encoded comments')
+                        help='input encoded comments array directory or '
+                        'pickle')
 
     parser.add_argument('--output1_h5', '-o', type=str,
                         dest='output1_h5', action='store',
@@ -57,34 +73,63 @@ def get_arguments():
                         dest='output3_h5', action='store',
                         help='the output biGRU fasttext Crawl model')
 
+    parser.add_argument('--embed_dir', '-e', type=str, dest='embed_dir',
+                        action='store', default=None,
+                        help='optional shared directory for the frozen '
+                        'embedding weights, see packed_models.py')
+
+    parser.add_argument('--float16', dest='float16', action='store_true',
+                        default=False,
+                        help='store the packed embedding weights as float16')
+
+    parser.add_argument('--balance', dest='balance', action='store_true',
+                        default=False,
+                        help='train on minibatches oversampled to balance '
+                        'the themes, for fixed length encodings')
+
     args = parser.parse_args()
     return args
 
 
-def train_biGRU(X_train, Y_train, embed_name, embed_matrix):
+def build_biGRU(embed_matrix, maxlen=700):
+    '''Returns the compiled biGRU model. With maxlen None it takes sequences
+    of any length and masks the padding of each batch.'''
 
     # Define parameters for Neural Net Architecture
     max_features = embed_matrix.shape[0]
-    maxlen = 700
-    batch_size = 128
     filters = 64
     kernel_size = 3
-    epochs = 12
     embed_size = 300
 
     # Neural Net Architecture
     inp = Input(shape=(maxlen, ))
 
-    x = Embedding(max_features, embed_size, weights=[embed_matrix],
-                  trainable=False)(inp)
-
-    x = Bidirectional(GRU(128, return_sequences=True, dropout=0.1,
-                          recurrent_dropout=0.1))(x)
-    x = Conv1D(filters, kernel_size=kernel_size, padding="valid",
-               kernel_initializer="glorot_uniform")(x)
-
-    avg_pool = GlobalAveragePooling1D()(x)
-    max_pool = GlobalMaxPooling1D()(x)
+    if maxlen is not None:
+        x = Embedding(max_features, embed_size, weights=[embed_matrix],
+                      trainable=False)(inp)
+
+        x = Bidirectional(GRU(128, return_sequences=True, dropout=0.1,
+                              recurrent_dropout=0.1))(x)
+        x = Conv1D(filters, kernel_size=kernel_size, padding="valid",
+                   kernel_initializer="glorot_uniform")(x)
+
+        avg_pool = GlobalAveragePooling1D()(x)
+        max_pool = GlobalMaxPooling1D()(x)
+    else:
+        # Sequences of any length are padded per batch. The padding is masked
+        # so the GRU skips it, and the pooling only covers the windows that
+        # end on a token, see masked_pooling.py
+        x = Embedding(max_features, embed_size, weights=[embed_matrix],
+                      trainable=False, mask_zero=True)(inp)
+
+        x = Bidirectional(GRU(128, return_sequences=True, dropout=0.1,
+                              recurrent_dropout=0.1))(x)
+        x = RemoveMask()(x)
+        x = Conv1D(filters, kernel_size=kernel_size, padding="valid",
+                   kernel_initializer="glorot_uniform")(x)
+
+        avg_pool = MaskedGlobalPooling1D('average', kernel_size)([x, inp])
+        max_pool = MaskedGlobalPooling1D('max', kernel_size)([x, inp])
 
     x = concatenate([avg_pool, max_pool])
 
@@ -95,9 +140,56 @@ def train_biGRU(X_train, Y_train, embed_name, embed_matrix):
     model.compile(loss='binary_crossentropy', optimizer='adam',
                   metrics=['accuracy'])
 
-    # Train Model
-    model.fit(X_train, Y_train, batch_size=batch_size,
-              epochs=epochs, validation_split=0.15)
+    return model
+
+
+def train_biGRU(X_train, Y_train, embed_name, embed_matrix, balance=False):
+
+    batch_size = 128
+    epochs = 12
+
+    if not is_ragged(X_train):
+        model = build_biGRU(embed_matrix, maxlen=700)
+
+        if not balance:
+            # Train Model
+            model.fit(X_train, Y_train, batch_size=batch_size,
+                      epochs=epochs, validation_split=0.15)
+
+            return model
+
+        # Train on balanced batches drawn from the first 85% of the
+        # comments, validating on the rest like validation_split
+        split_at = int(len(X_train) * (1 - 0.15))
+        model.fit_generator(
+            balanced_batches(X_train[:split_at], Y_train[:split_at],
+                             batch_size),
+            steps_per_epoch=balanced_steps_per_epoch(Y_train[:split_at],
+                                                     batch_size),
+            epochs=epochs,
+            validation_data=(X_train[split_at:], Y_train[split_at:]))
+
+        return model
+
+    if balance:
+        raise ValueError('balanced batches need fixed length encodings, '
+                         'not ragged ones')
+
+    # Train on length bucketed batches, validating on the last 15% of the
+    # comments like validation_split
+    model = build_biGRU(embed_matrix, maxlen=None)
+    n_comments = len(X_train['offsets']) - 1
+    split_at = int(n_comments * (1 - 0.15))
+    X_fit = slice_ragged(X_train, 0, split_at)
+    X_val = slice_ragged(X_train, split_at, n_comments)
+
+    model.fit_generator(
+        bucketed_batches(X_fit, Y_train[:split_at], batch_size),
+        steps_per_epoch=bucketed_steps_per_epoch(X_fit, batch_size),
+        epochs=epochs,
+        validation_data=bucketed_batches(X_val, Y_train[split_at:],
+                                         batch_size, shuffle=False),
+        validation_steps=bucketed_steps_per_epoch(X_val, batch_size))
 
     return model
 
@@ -106,6 +198,7 @@ def train_biGRU(X_train, Y_train, embed_name, embed_matrix):
 if __name__ == "__main__":
 
     args = get_arguments()
+    K.set_learning_phase(1)
 
     embed_names = ['glove_crawl', 'glove_wiki', 'fasttext_crawl']
 
@@ -113,13 +206,9 @@ if __name__ == "__main__":
     df = pd.read_csv(args.input_csv)
     Y_train = np.array(df.loc[:, "CPD":"OTH"])
 
-    # Load embedding matrices
-    with open(args.input_pk1, 'rb') as handle:
-        embed_matrices = pickle.load(handle)
-
-    # Load training data
-    with open(args.input_pk2, 'rb') as handle:
-        X_train_encoded = pickle.load(handle)
+    # Load embedding matrices and training data
+    embed_matrices = load_arrays(args.input_pk1, embed_names)
+    X_train_encoded = load_arrays(args.input_pk2, embed_names)
 
     # Train biGRU models and save in the models folder
     biGRU_models = {}
@@ -128,8 +217,15 @@ if __name__ == "__main__":
 
         biGRU_models[embed] = train_biGRU(X_train_encoded[embed],
                                           Y_train, embed,
-                                          embed_matrices[embed])
+                                          embed_matrices[embed], args.balance)
 
-    biGRU_models['glove_crawl'].save(args.output1_h5)
-    biGRU_models['glove_wiki'].save(args.output2_h5)
-    biGRU_models['fasttext_crawl'].save(args.output3_h5)
+    output_h5s = {'glove_crawl': args.output1_h5,
+                  'glove_wiki': args.output2_h5,
+                  'fasttext_crawl': args.output3_h5}
+    for embed in embed_names:
+        if args.embed_dir is not None:
+            save_packed_model(biGRU_models[embed], output_h5s[embed],
+                              args.embed_dir,
+                              'float16' if args.float16 else 'float32')
+        else:
+            biGRU_models[embed].save(output_h5s[embed])
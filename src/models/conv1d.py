@@ -3,25 +3,40 @@
 # Date: 2019-06-09
 
 # This script defines a function that trains a convulutional neural net for
-# each embedding and saves it in the models folder.
+# each embedding and saves it in the models folder. If the encoded comments
+# are ragged, see encode_comments.py --ragged, the model takes sequences of
+# any length and is trained on length bucketed batches. With --balance the
+# model is trained on minibatches oversampled to balance the themes, see
+# balanced_batches in preprocessing_text.py. With --embed_dir the model is
+# saved without its frozen embedding weights, see packed_models.py.
 
 # USAGE:
 '''
 python src/models/conv1d.py \
 --input_csv data/interim/train_2018-qualitative-data.csv \
---input_pk1 models/embed_matrices.pickle \
---input_pk2 data/processed/X_train_encoded.pickle \
---output_h5 models/conv1d_models.h5
+--input_pk1 models/embed_matrices \
+--input_pk2 data/processed/X_train_encoded \
+--output_h5 models/conv1d_models.h5 \
+--embed_dir models/embeddings
 '''
 
 # Import Modules
-import pickle
+import sys
+sys.path.insert(1, '.')
 import pandas as pd
 import numpy as np
 from keras.layers import Dense, Embedding, Dropout, Activation
-from keras.layers import GlobalMaxPooling1D, Conv1D
-from keras.models import Sequential
+from keras.layers import GlobalMaxPooling1D, Input, Conv1D
+from keras.models import Sequential, Model
 import argparse
+from src.features.ragged_sequences import is_ragged, slice_ragged
+from src.features.ragged_sequences import bucketed_batches
+from src.features.ragged_sequences import bucketed_steps_per_epoch
+from src.features.array_store import load_arrays
+from src.data.preprocessing_text import balanced_batches
+from src.data.preprocessing_text import balanced_steps_per_epoch
+from src.models.packed_models import save_packed_model
+from src.models.masked_pooling import MaskedGlobalPooling1D
 
 
 def get_arguments():
@@ -33,53 +48,140 @@ def get_arguments():
 
     parser.add_argument('--input_pk1', '-i2', type=str, dest='input_pk1',
                         action='store',
-                        help='the input embedding_matrix')
+                        help='the input embedding_matrix array directory or '
+                        'pickle')
 
     parser.add_argument('--input_pk2', '-i3', type=str, dest='input_pk2',
                         action='store',
-                        help='input encoded comments')
+                        help='input encoded comments array directory or '
+                        'pickle')
 
     parser.add_argument('--output_h5', '-o', type=str,
                         dest='output_h5', action='store',
                         help='the output conv1d model')
 
+    parser.add_argument('--embed_dir', '-e', type=str, dest='embed_dir',
+                        action='store', default=None,
+                        help='optional shared directory for the frozen '
+                        'embedding weights, see packed_models.py')
+
+    parser.add_argument('--float16', dest='float16', action='store_true',
+                        default=False,
+                        help='store the packed embedding weights as float16')
+
+    parser.add_argument('--balance', dest='balance', action='store_true',
+                        default=False,
+                        help='train on minibatches oversampled to balance '
+                        'the themes, for fixed length encodings')
+
     args = parser.parse_args()
     return args
 
 
-def train_conv1d(X_train, Y_train, embed_name, embed_matrix):
+def build_conv1d(embed_matrix, maxlen=700):
+    '''Returns the compiled conv1d model. With maxlen None it takes sequences
+    of any length and pools over the tokens of each comment only.'''
 
     # Define parameters for Neural Net Architecture
     max_features = embed_matrix.shape[0]
-    maxlen = 700
-    batch_size = 128
     filters = 250
     kernel_size = 3
     hidden_dims = 250
-    epochs = 7
     embed_size = 300
 
     # Neural Net Architecture
-    model = Sequential()
-
-    model.add(Embedding(max_features, embed_size, weights=[embed_matrix],
-                        trainable=False, input_length=maxlen))
-
-    model.add(Dropout(0.2))
-    model.add(Conv1D(filters, kernel_size, padding='valid', activation='relu',
-                     strides=1))
-    model.add(GlobalMaxPooling1D())
-    model.add(Dense(hidden_dims))
-    model.add(Dropout(0.2))
-    model.add(Activation('relu'))
-    model.add(Dense(12))
-    model.add(Activation('sigmoid'))
+    if maxlen is not None:
+        model = Sequential()
+
+        model.add(Embedding(max_features, embed_size, weights=[embed_matrix],
+                            trainable=False, input_length=maxlen))
+
+        model.add(Dropout(0.2))
+        model.add(Conv1D(filters, kernel_size, padding='valid',
+                         activation='relu', strides=1))
+        model.add(GlobalMaxPooling1D())
+        model.add(Dense(hidden_dims))
+        model.add(Dropout(0.2))
+        model.add(Activation('relu'))
+        model.add(Dense(12))
+        model.add(Activation('sigmoid'))
+        model.compile(loss='binary_crossentropy', optimizer='adam',
+                      metrics=['accuracy'])
+
+        return model
+
+    # Sequences of any length are padded per batch. The padding embeds as
+    # zeros, and the pooling only covers the windows that end on a token, see
+    # masked_pooling.py
+    inp = Input(shape=(maxlen, ))
+
+    x = Embedding(max_features, embed_size, weights=[embed_matrix],
+                  trainable=False)(inp)
+
+    x = Dropout(0.2)(x)
+    x = Conv1D(filters, kernel_size, padding='valid', activation='relu',
+               strides=1)(x)
+    x = MaskedGlobalPooling1D('max', kernel_size)([x, inp])
+    x = Dense(hidden_dims)(x)
+    x = Dropout(0.2)(x)
+    x = Activation('relu')(x)
+    x = Dense(12)(x)
+    preds = Activation('sigmoid')(x)
+
+    model = Model(inp, preds)
     model.compile(loss='binary_crossentropy', optimizer='adam',
                   metrics=['accuracy'])
 
-    # Train Model
-    model.fit(X_train, Y_train, batch_size=batch_size, epochs=epochs,
-              validation_split=0.15)
+    return model
+
+
+def train_conv1d(X_train, Y_train, embed_name, embed_matrix, balance=False):
+
+    batch_size = 128
+    epochs = 7
+
+    if not is_ragged(X_train):
+        model = build_conv1d(embed_matrix, maxlen=700)
+
+        if not balance:
+            # Train Model
+            model.fit(X_train, Y_train, batch_size=batch_size, epochs=epochs,
+                      validation_split=0.15)
+
+            return model
+
+        # Train on balanced batches drawn from the first 85% of the
+        # comments, validating on the rest like validation_split
+        split_at = int(len(X_train) * (1 - 0.15))
+        model.fit_generator(
+            balanced_batches(X_train[:split_at], Y_train[:split_at],
+                             batch_size),
+            steps_per_epoch=balanced_steps_per_epoch(Y_train[:split_at],
+                                                     batch_size),
+            epochs=epochs,
+            validation_data=(X_train[split_at:], Y_train[split_at:]))
+
+        return model
+
+    if balance:
+        raise ValueError('balanced batches need fixed length encodings, '
+                         'not ragged ones')
+
+    # Train on length bucketed batches, validating on the last 15% of the
+    # comments like validation_split
+    model = build_conv1d(embed_matrix, maxlen=None)
+    n_comments = len(X_train['offsets']) - 1
+    split_at = int(n_comments * (1 - 0.15))
+    X_fit = slice_ragged(X_train, 0, split_at)
+    X_val = slice_ragged(X_train, split_at, n_comments)
+
+    model.fit_generator(
+        bucketed_batches(X_fit, Y_train[:split_at], batch_size),
+        steps_per_epoch=bucketed_steps_per_epoch(X_fit, batch_size),
+        epochs=epochs,
+        validation_data=bucketed_batches(X_val, Y_train[split_at:],
+                                         batch_size, shuffle=False),
+        validation_steps=bucketed_steps_per_epoch(X_val, batch_size))
 
     return model
 
@@ -95,17 +197,17 @@ if __name__ == "__main__":
     df = pd.read_csv(args.input_csv)
     Y_train = np.array(df.loc[:, "CPD":"OTH"])
 
-    # Load embedding matrices
-    with open(args.input_pk1, 'rb') as handle:
-        embed_matrices = pickle.load(handle)
-
-    # Load training data
-    with open(args.input_pk2, 'rb') as handle:
-        X_train_encoded = pickle.load(handle)
+    # Load the embedding matrix and training data of only this embedding
+    embed_matrices = load_arrays(args.input_pk1, [embed])
+    X_train_encoded = load_arrays(args.input_pk2, [embed])
 
     # Train Conv1d models and save in the models folder
     print('Training conv1d on', embed, 'embedding')
     conv1d_model = train_conv1d(X_train_encoded[embed], Y_train, embed,
-                                embed_matrices[embed])
+                                embed_matrices[embed], args.balance)
 
-    conv1d_model.save(args.output_h5)
+    if args.embed_dir is not None:
+        save_packed_model(conv1d_model, args.output_h5, args.embed_dir,
+                          'float16' if args.float16 else 'float32')
+    else:
+        conv1d_model.save(args.output_h5)
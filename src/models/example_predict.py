@@ -4,20 +4,23 @@
 # Date: 2019-06-26
 
 # Use script for quick demo to type an example comment at the command line.
-# The script utilizes the models for predictions
+# The script utilizes the models for predictions. The comment is encoded with
+# models/embed_tokenizers.json when it exists, and the pickled keras
+# tokenizers otherwise.
 
 text = input("Type Comment: ")
 
 
 import sys
 sys.path.insert(1, '.')
+import os
 import warnings
 warnings.filterwarnings("ignore")
-import pickle
 import pandas as pd
 from src.features.encode_comments import get_encoded_comments
+from src.features.compact_tokenizer import load_tokenizers
+from src.models.packed_models import load_packed_model
 import numpy as np
-from keras.models import load_model
 
 
 df = pd.DataFrame({'comment': [text]})
@@ -26,19 +29,22 @@ comments = df.iloc[:, 0]
 embed_names = ['glove_crawl', 'glove_wiki', 'fasttext_crawl']
 
 # Load Embedding Tokenizers
-with open('./models/embed_tokenizers.pickle', 'rb') as handle:
-    embed_tokenizers = pickle.load(handle)
+if os.path.exists('./models/embed_tokenizers.json'):
+    embed_tokenizers = load_tokenizers('./models/embed_tokenizers.json')
+else:
+    embed_tokenizers = load_tokenizers('./models/embed_tokenizers.pickle')
 
-# Load Neural Net Classification Models
-conv1d = load_model('./models/conv1d_models.h5')
-
-# Make predictions
+# Encode the comment
 encoded_comments = {}
 for embed in embed_names:
     encoded_comments[embed] = get_encoded_comments(comments,
                                                    embed_tokenizers[embed],
                                                    embed)
 
+# Load Neural Net Classification Models, saved by keras or packed
+conv1d = load_packed_model('./models/conv1d_models.h5')
+
+# Make predictions
 Y_pred = conv1d.predict(encoded_comments['glove_wiki'])
 
 # Format predictions and save to csv
@@ -13,13 +13,15 @@ python src/models/linearsvc.py \
 '''
 
 # Import Modules
+import sys
+sys.path.insert(1, '.')
 import pandas as pd
 import numpy as np
-import scipy.sparse
 from skmultilearn.problem_transform import BinaryRelevance
 from sklearn.svm import LinearSVC
 import pickle
 import argparse
+from src.features.vectorize_comments import load_vectorized
 
 
 # Default filepath
@@ -37,7 +39,8 @@ def get_arguments():
 
     parser.add_argument('--input_npz', '-i2', type=str, dest='input_npz',
                         action='store', default=filepath_in2,
-                        help='the input csv file with comments and labels')
+                        help='the input npz file or shard directory of '
+                        'vectorized comments')
 
     parser.add_argument('--output_pk', '-o', type=str, dest='output_pk',
                         action='store', default=filepath_out,
@@ -67,8 +70,8 @@ if __name__ == "__main__":
     df = pd.read_csv(args.input_csv)
     Y_train = np.array(df.loc[:, "CPD":"OTH"])
 
-    # read in npz file
-    X_train = scipy.sparse.load_npz(args.input_npz)
+    # read in npz file or shards
+    X_train = load_vectorized(args.input_npz)
 
     linearsvc_model = train_linearsvc(X_train, Y_train)
 
@@ -0,0 +1,80 @@
+# masked_pooling.py
+# Author: Aaron Quinton
+# Date: 2019-07-15
+
+# Comments are padded with zeros in front to the length of their batch, so
+# without a mask the global pooling of the conv1d and biGRU models averages
+# or maxes over the padding, and the prediction of a comment depends on the
+# other comments in its batch. These layers pool only over the convolution
+# windows that end on a token of the comment. The biGRU masks the padding
+# from its Embedding, so the GRU skips it, and the mask is removed before the
+# Conv1D which does not support masking.
+#
+# The windows that end on the first tokens of a comment also cover the
+# kernel_size - 1 positions before it, so comments are padded with at least
+# that many zeros, see ragged_sequences.py. The windows then see the same
+# values however long the padding is.
+
+# Import Modules
+from keras import backend as K
+from keras.layers import Layer
+
+
+class RemoveMask(Layer):
+    '''Passes its input through without the mask of the previous layer'''
+
+    def __init__(self, **kwargs):
+        super(RemoveMask, self).__init__(**kwargs)
+        self.supports_masking = True
+
+    def call(self, inputs, mask=None):
+        return inputs
+
+    def compute_mask(self, inputs, mask=None):
+        return None
+
+
+class MaskedGlobalPooling1D(Layer):
+    '''Global average or max pooling of the outputs of a 'valid' Conv1D over
+    the windows that end on a token, ignoring the zero padding. Comments
+    without tokens pool to zeros.
+
+    Called on [conv_outputs, token_indices].
+
+    Parameters
+    ----------
+    pooling : str
+        'average' or 'max'
+    kernel_size : int
+        The kernel size of the Conv1D
+    '''
+    def __init__(self, pooling='average', kernel_size=3, **kwargs):
+        super(MaskedGlobalPooling1D, self).__init__(**kwargs)
+        self.pooling = pooling
+        self.kernel_size = kernel_size
+
+    def call(self, inputs):
+        outputs, tokens = inputs
+        mask = K.cast(K.not_equal(tokens[:, self.kernel_size - 1:], 0),
+                      K.floatx())
+        mask = K.expand_dims(mask, axis=-1)
+        n_windows = K.sum(mask, axis=1)
+
+        if self.pooling == 'average':
+            return K.sum(outputs * mask, axis=1) / K.maximum(n_windows, 1.)
+
+        has_windows = K.cast(K.greater(n_windows, 0.), K.floatx())
+        return K.max(outputs - (1. - mask) * 1e9, axis=1) * has_windows
+
+    def compute_output_shape(self, input_shape):
+        return (input_shape[0][0], input_shape[0][2])
+
+    def get_config(self):
+        config = {'pooling': self.pooling, 'kernel_size': self.kernel_size}
+        base_config = super(MaskedGlobalPooling1D, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
+
+
+# Passed to keras load_model and model_from_json
+custom_objects = {'RemoveMask': RemoveMask,
+                  'MaskedGlobalPooling1D': MaskedGlobalPooling1D}
@@ -0,0 +1,206 @@
+# packed_models.py
+# Author: Aaron Quinton
+# Date: 2019-07-14
+
+# Every saved conv1d and biGRU model carries its own copy of its frozen
+# 12000 x 300 embedding matrix, and conv1d and biGRU_glove_wiki carry the same
+# glove_wiki matrix. This module saves a model without its frozen Embedding
+# weights, which are saved once to a shared directory, optionally as float16,
+# and named by a hash of the matrix so identical matrices are stored once.
+# The weights are attached again when the model is loaded. Models loaded with
+# the same tables dict read each matrix from disk once, but each model still
+# holds its own copy in memory as keras copies the weights into the layer.
+#
+# A packed model is an .h5 file with the model_config of the keras model, its
+# other weights, and the relative path of each packed embedding. Packed models
+# are for prediction, the optimizer state is not saved.
+
+# USAGE:
+'''
+python src/models/packed_models.py \
+--input_h5 models/conv1d_models.h5 models/biGRU_glove_wiki.h5 \
+--embed_dir models/embeddings \
+--float16
+'''
+
+# Import Modules
+import sys
+sys.path.insert(1, '.')
+import os
+import json
+import hashlib
+import argparse
+import h5py
+import numpy as np
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Pack keras models with '
+                                     'their frozen embeddings stored once')
+
+    parser.add_argument('--input_h5', '-i', type=str, dest='input_h5',
+                        action='store', nargs='+',
+                        help='the keras models, which are packed in place')
+
+    parser.add_argument('--embed_dir', '-e', type=str, dest='embed_dir',
+                        action='store', default='models/embeddings',
+                        help='the shared directory of embedding matrices')
+
+    parser.add_argument('--float16', dest='float16', action='store_true',
+                        default=False,
+                        help='store the embedding matrices as float16')
+
+    args = parser.parse_args()
+    return args
+
+
+def get_frozen_embeddings(model):
+    '''Returns the Embedding layers of a model that are not trainable'''
+
+    from keras.layers import Embedding
+
+    return [layer for layer in model.layers
+            if isinstance(layer, Embedding) and not layer.trainable]
+
+
+def save_embedding_table(matrix, embed_dir, dtype='float32'):
+    '''Save an embedding matrix to the shared directory, unless the same
+    matrix is already saved with this dtype
+
+    Returns
+    -------
+    filepath : str of the .npy file
+    '''
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    digest = hashlib.blake2b(matrix.tobytes(), digest_size=8).hexdigest()
+    filepath = os.path.join(embed_dir, '%s.%s.npy' % (digest, dtype))
+
+    if not os.path.exists(filepath):
+        os.makedirs(embed_dir, exist_ok=True)
+        np.save(filepath + '.tmp.npy', matrix.astype(dtype))
+        os.replace(filepath + '.tmp.npy', filepath)
+
+    return filepath
+
+
+def save_packed_model(model, filepath, embed_dir, dtype='float32'):
+    '''Save a keras model with its frozen embeddings in embed_dir
+
+    Parameters
+    ----------
+    model : keras model
+    filepath : str
+        The .h5 file of the model
+    embed_dir : str
+        The shared directory of embedding matrices
+    dtype : str
+        'float32' or 'float16' for the stored matrices
+    '''
+    packed = {}
+    for layer in get_frozen_embeddings(model):
+        table = save_embedding_table(layer.get_weights()[0], embed_dir, dtype)
+        packed[layer.name] = os.path.relpath(
+            table, os.path.dirname(os.path.abspath(filepath)))
+
+    # Models are packed in place, so the file is only replaced once it is
+    # written completely
+    try:
+        with h5py.File(filepath + '.tmp', 'w') as handle:
+            handle.attrs['model_config'] = model.to_json()
+            handle.attrs['packed_embeddings'] = json.dumps(packed)
+
+            model_weights = handle.create_group('model_weights')
+            for layer in model.layers:
+                if layer.name in packed:
+                    continue
+                group = model_weights.create_group(layer.name)
+                for i, weights in enumerate(layer.get_weights()):
+                    group.create_dataset(str(i), data=weights)
+    except BaseException:
+        if os.path.exists(filepath + '.tmp'):
+            os.remove(filepath + '.tmp')
+        raise
+
+    os.replace(filepath + '.tmp', filepath)
+
+
+def is_packed_model(filepath):
+    with h5py.File(filepath, 'r') as handle:
+        return 'packed_embeddings' in handle.attrs
+
+
+def load_packed_model(filepath, tables=None):
+    '''Load a packed model, or a model saved by keras with load_model
+
+    Parameters
+    ----------
+    filepath : str
+    tables : dict, optional
+        The embedding matrices already loaded, by file path. Matrices read
+        by this model are added to it, so models loaded with the same dict
+        read each matrix once. Each model still copies it into its weights.
+
+    Returns
+    -------
+    model : keras model
+    '''
+    from keras.models import load_model, model_from_json
+    from src.models.masked_pooling import custom_objects
+
+    if not is_packed_model(filepath):
+        return load_model(filepath, custom_objects=custom_objects)
+
+    if tables is None:
+        tables = {}
+
+    with h5py.File(filepath, 'r') as handle:
+        model_config = handle.attrs['model_config']
+        packed = json.loads(handle.attrs['packed_embeddings'])
+        weights = {name: [group[str(i)][()] for i in range(len(group))]
+                   for name, group in handle['model_weights'].items()}
+
+    model = model_from_json(model_config, custom_objects)
+    for layer in model.layers:
+        if layer.name in packed:
+            table = os.path.normpath(os.path.join(
+                os.path.dirname(os.path.abspath(filepath)),
+                packed[layer.name]))
+            if table not in tables:
+                tables[table] = np.load(table, mmap_mode='r')
+            layer.set_weights([tables[table]])
+        elif layer.name in weights:
+            layer.set_weights(weights[layer.name])
+
+    return model
+
+
+def pack_model(filepath, embed_dir, dtype='float32'):
+    '''Pack a model saved by keras in place
+
+    Returns
+    -------
+    sizes : the file size in bytes before and after packing
+    '''
+    from keras.models import load_model
+    from src.models.masked_pooling import custom_objects
+
+    size = os.path.getsize(filepath)
+    model = load_model(filepath, custom_objects=custom_objects)
+    save_packed_model(model, filepath, embed_dir, dtype)
+
+    return size, os.path.getsize(filepath)
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    args = get_arguments()
+
+    dtype = 'float16' if args.float16 else 'float32'
+    for filepath in args.input_h5:
+        if is_packed_model(filepath):
+            print(filepath, 'is already packed')
+            continue
+        before, after = pack_model(filepath, args.embed_dir, dtype)
+        print('Packed %s from %.1f MB to %.1f MB'
+              % (filepath, before / 2 ** 20, after / 2 ** 20))
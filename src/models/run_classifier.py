@@ -2,7 +2,11 @@
 # Author: Fan Nie, Ayla Pearson, Aaron Quinton
 # Date: 2019-06-09
 
-# This script predicts the labels and saves the output.
+# This script predicts the labels and saves the output. The comments are
+# encoded with the compact tokenizers in models/embed_tokenizers.json when it
+# exists, so keras is only imported to load the models. Otherwise the pickled
+# keras tokenizers are used. The models can be saved by keras or packed, see
+# packed_models.py.
 
 # USAGE:
 '''
@@ -13,17 +17,22 @@ python src/models/run_classifier.py \
 
 import sys
 sys.path.insert(1, '.')
-import pickle
+import os
 import pandas as pd
 import argparse
-from src.features.encode_comments import get_encoded_comments
+from src.features.encode_comments import get_all_encoded_comments
+from src.data.preprocessing_text import PreprocessingCache
+from src.features.ragged_sequences import predict_sequences
+from src.features.compact_tokenizer import load_tokenizers
+from src.models.packed_models import load_packed_model
 import numpy as np
-from keras.models import load_model
 
 
 # Default File paths:
 filepath_in = 'predict/predict_input/predict_comments_in.csv'
 filepath_out = 'predict/predict_output/predict_comments_out.csv'
+tokenizers_json = './models/embed_tokenizers.json'
+tokenizers_pk = './models/embed_tokenizers.pickle'
 
 
 def get_arguments():
@@ -38,6 +47,10 @@ def get_arguments():
                         dest='output_csv', action='store',
                         default=filepath_out, help='the output csv file')
 
+    parser.add_argument('--cache_db', '-c', type=str, dest='cache_db',
+                        action='store', default=None,
+                        help='optional sqlite cache of preprocessed comments')
+
     args = parser.parse_args()
     return args
 
@@ -52,26 +65,40 @@ if __name__ == "__main__":
     comments = df.iloc[:, 1]
 
     # Load Embedding Tokenizers
-    with open('./models/embed_tokenizers.pickle', 'rb') as handle:
-        embed_tokenizers = pickle.load(handle)
+    if os.path.exists(tokenizers_json):
+        embed_tokenizers = load_tokenizers(tokenizers_json)
+    else:
+        embed_tokenizers = load_tokenizers(tokenizers_pk)
+
+    # Encode comments
+    # The comments are encoded as ragged sequences, which are padded to 700
+    # for models with a fixed input length and bucketed by length otherwise
+    cache = PreprocessingCache(args.cache_db)
+    encoded_comments = get_all_encoded_comments(
+        comments, {embed: embed_tokenizers[embed] for embed in embed_names},
+        cache, ragged=True)
+    cache.close()
 
     # Load Neural Net Classification Models
-    conv1d = load_model('./models/conv1d_models.h5')
-    biGRU_glove_crawl = load_model('./models/biGRU_glove_crawl.h5')
-    biGRU_glove_wiki = load_model('./models/biGRU_glove_wiki.h5')
-    biGRU_fasttext_crawl = load_model('./models/biGRU_fasttext_crawl.h5')
+    # keras is imported when the first model is loaded, after the comments
+    # are encoded. Packed models read each embedding matrix from disk once.
+    embed_tables = {}
+    conv1d = load_packed_model('./models/conv1d_models.h5', embed_tables)
+    biGRU_glove_crawl = load_packed_model('./models/biGRU_glove_crawl.h5',
+                                          embed_tables)
+    biGRU_glove_wiki = load_packed_model('./models/biGRU_glove_wiki.h5',
+                                         embed_tables)
+    biGRU_fasttext_crawl = load_packed_model(
+        './models/biGRU_fasttext_crawl.h5', embed_tables)
 
     # Make predictions
-    encoded_comments = {}
-    for embed in embed_names:
-        encoded_comments[embed] = get_encoded_comments(comments,
-                                                       embed_tokenizers[embed],
-                                                       embed)
-
-    ensemble = (conv1d.predict(encoded_comments['glove_wiki'])
-        + biGRU_glove_crawl.predict(encoded_comments['glove_crawl'])
-        + biGRU_glove_wiki.predict(encoded_comments['glove_wiki'])
-        + biGRU_fasttext_crawl.predict(encoded_comments['fasttext_crawl']))/4
+
+    ensemble = (predict_sequences(conv1d, encoded_comments['glove_wiki'])
+        + predict_sequences(biGRU_glove_crawl,
+                            encoded_comments['glove_crawl'])
+        + predict_sequences(biGRU_glove_wiki, encoded_comments['glove_wiki'])
+        + predict_sequences(biGRU_fasttext_crawl,
+                            encoded_comments['fasttext_crawl']))/4
 
     # Format predictions and save to csv
     predictions = pd.DataFrame(np.round(ensemble-0.42))
@@ -2,14 +2,16 @@
 # Author: Fan Nie, Ayla Pearson, Aaron Quinton
 # Date: 2019-06-09
 
-# This script predicts the theme on the test data for every model
+# This script predicts the theme on the test data for every model. The neural
+# net models can be saved by keras or packed, see packed_models.py, and packed
+# models read each embedding matrix from disk once.
 
 # USAGE:
 
 '''
 python src/models/theme_classification.py \
 --input_pk1 models/linearsvc_model.pickle \
---input_pk2 data/processed/X_test_encoded.pickle \
+--input_pk2 data/processed/X_test_encoded \
 --input_npz data/processed/X_test_bow.npz \
 --input1_h5 models/conv1d_models.h5 \
 --input2_h5 models/biGRU_glove_crawl.h5 \
@@ -25,7 +27,10 @@ import numpy as np
 import pandas as pd
 import scipy.sparse
 import argparse
-from keras.models import load_model
+from src.features.vectorize_comments import iter_vectorized
+from src.features.ragged_sequences import predict_sequences
+from src.features.array_store import load_arrays
+from src.models.packed_models import load_packed_model
 
 
 def get_arguments():
@@ -37,11 +42,12 @@ def get_arguments():
 
     parser.add_argument('--input_pk2', '-i2', type=str, dest='input_pk2',
                         action='store',
-                        help='input encoded comments')
+                        help='input encoded comments array directory or '
+                        'pickle')
 
     parser.add_argument('--input_npz', '-i3', type=str, dest='input_npz',
                         action='store',
-                        help='input bow comments')
+                        help='input bow comments npz file or shard directory')
 
     parser.add_argument('--input1_h5', '-i4', type=str,
                         dest='input1_h5', action='store',
@@ -71,33 +77,37 @@ args = get_arguments()
 
 ##############################################################################
 # Predict test data themes with Baseline BOW and Linear SVC Model
-# Load Vectorized comments
-X_text_bow = scipy.sparse.load_npz(args.input_npz)
-
 # Load Linear SVC Model
 with open(args.input_pk1, 'rb') as handle:
     linearsvc_model = pickle.load(handle)
 
-# Predict themes
-Y_bow = linearsvc_model.predict(X_text_bow)
+# Predict themes one npz file or shard of vectorized comments at a time
+Y_bow = scipy.sparse.vstack([linearsvc_model.predict(X_text_bow)
+                             for X_text_bow in iter_vectorized(args.input_npz)],
+                            format='csr')
 
 
 ###############################################################################
 # Predict test data labels with Conv1d and biGRU Models
 # Load Encoded Comments
-with open(args.input_pk2, 'rb') as handle:
-    X_test_encoded = pickle.load(handle)
+X_test_encoded = load_arrays(args.input_pk2,
+                             ['glove_crawl', 'glove_wiki', 'fasttext_crawl'])
 
 # Load Neural Net Classification Models
-conv1d = load_model(args.input1_h5)
-biGRU_glove_crawl = load_model(args.input2_h5)
-biGRU_glove_wiki = load_model(args.input3_h5)
-biGRU_fasttext_crawl = load_model(args.input4_h5)
-
-ensemble = (conv1d.predict(X_test_encoded['glove_wiki'])
-            + biGRU_glove_crawl.predict(X_test_encoded['glove_crawl'])
-            + biGRU_glove_wiki.predict(X_test_encoded['glove_wiki'])
-            + biGRU_fasttext_crawl.predict(X_test_encoded['fasttext_crawl']))/4
+embed_tables = {}
+conv1d = load_packed_model(args.input1_h5, embed_tables)
+biGRU_glove_crawl = load_packed_model(args.input2_h5, embed_tables)
+biGRU_glove_wiki = load_packed_model(args.input3_h5, embed_tables)
+biGRU_fasttext_crawl = load_packed_model(args.input4_h5, embed_tables)
+
+# The encoded comments can be padded arrays or ragged sequences
+ensemble = (predict_sequences(conv1d, X_test_encoded['glove_wiki'])
+            + predict_sequences(biGRU_glove_crawl,
+                                X_test_encoded['glove_crawl'])
+            + predict_sequences(biGRU_glove_wiki,
+                                X_test_encoded['glove_wiki'])
+            + predict_sequences(biGRU_fasttext_crawl,
+                                X_test_encoded['fasttext_crawl']))/4
 
 ###############################################################################
 # Save test data predictions
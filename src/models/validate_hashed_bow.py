@@ -0,0 +1,114 @@
+# validate_hashed_bow.py
+# Author: Aaron Quinton
+# Date: 2019-07-10
+
+# This script checks the hashed bag of words vectorizer against the fitted
+# CountVectorizer. For each vectorizer a LinearSVC model is trained on the
+# train comments and evaluated on the test comments, and the time to fit,
+# the size of the pickled vectorizer and the number of columns are reported
+# with the theme classification metrics.
+
+# USAGE:
+'''
+python src/models/validate_hashed_bow.py \
+--train_csv data/interim/train_2018-qualitative-data.csv \
+--test_csv data/interim/test_2018-qualitative-data.csv \
+--n_features 262144 1048576 4194304 \
+--cache_db data/interim/preprocessing_cache.sqlite
+'''
+
+# Import Modules
+import sys
+sys.path.insert(1, '.')
+import time
+import pickle
+import argparse
+import numpy as np
+import pandas as pd
+import sklearn.metrics as metrics
+from src.data.preprocessing_text import preprocess_for_bow
+from src.data.preprocessing_text import PreprocessingCache
+from src.features.bow_vectorizer import fit_bow_vectorizer
+from src.models.linearsvc import train_linearsvc
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Compare LinearSVC accuracy '
+                                     'with hashed and fitted bow vectorizers')
+
+    parser.add_argument('--train_csv', '-i', type=str, dest='train_csv',
+                        action='store',
+                        help='the train csv file with comments and labels')
+
+    parser.add_argument('--test_csv', '-i2', type=str, dest='test_csv',
+                        action='store',
+                        help='the test csv file with comments and labels')
+
+    parser.add_argument('--n_features', '-n', type=int, dest='n_features',
+                        action='store', nargs='+',
+                        default=[2 ** 18, 2 ** 20, 2 ** 22],
+                        help='numbers of buckets of the hashed vectorizers')
+
+    parser.add_argument('--min_df', type=int, dest='min_df',
+                        action='store', default=2,
+                        help='minimum number of comments of an n-gram')
+
+    parser.add_argument('--cache_db', '-c', type=str, dest='cache_db',
+                        action='store', default=None,
+                        help='optional sqlite cache of preprocessed comments')
+
+    args = parser.parse_args()
+    return args
+
+
+def validate_vectorizer(texts_train, Y_train, texts_test, Y_test,
+                        n_features=None, min_df=2):
+    '''Fit a bow vectorizer and LinearSVC model and evaluate them on the test
+    comments
+
+    Returns
+    -------
+    results : list of the vectorizer size, time and test metrics
+    '''
+    start = time.perf_counter()
+    vectorizer = fit_bow_vectorizer(texts_train, n_features, min_df)
+    X_train = vectorizer.transform(texts_train)
+    seconds = time.perf_counter() - start
+
+    model = train_linearsvc(X_train, Y_train)
+    Y_pred = model.predict(vectorizer.transform(texts_test)).toarray()
+
+    return [n_features or 'vocabulary', X_train.shape[1],
+            len(pickle.dumps(vectorizer)) / 1024, seconds,
+            metrics.accuracy_score(Y_test, Y_pred),
+            metrics.hamming_loss(Y_test, Y_pred),
+            metrics.precision_score(Y_test, Y_pred, average='micro'),
+            metrics.recall_score(Y_test, Y_pred, average='micro')]
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    args = get_arguments()
+
+    df_train = pd.read_csv(args.train_csv)
+    df_test = pd.read_csv(args.test_csv)
+    Y_train = np.array(df_train.loc[:, "CPD":"OTH"])
+    Y_test = np.array(df_test.loc[:, "CPD":"OTH"])
+
+    cache = PreprocessingCache(args.cache_db)
+    texts_train = list(preprocess_for_bow(df_train.iloc[:, 1], cache))
+    texts_test = list(preprocess_for_bow(df_test.iloc[:, 1], cache))
+    cache.close()
+
+    results = []
+    for n_features in [None] + args.n_features:
+        results.append(validate_vectorizer(texts_train, Y_train, texts_test,
+                                           Y_test, n_features, args.min_df))
+
+    results = pd.DataFrame(results, columns=['n_features', 'columns',
+                                             'pickle_kb', 'fit_s',
+                                             'accuracy', 'hamming_loss',
+                                             'micro_precision',
+                                             'micro_recall'])
+    print(results.round(4).to_string(index=False))
@@ -0,0 +1,157 @@
+# word_clouds.py
+# Author: Aaron Quinton
+# Date: 2019-07-08
+
+# This script renders a word cloud for every theme and subtheme of a coded
+# comment csv. The comments are counted once with a single document-term
+# matrix, the word frequencies of each theme are taken from it, and the
+# clouds are drawn from the frequencies on a headless backend by a pool of
+# processes. The frequencies can be saved to a pickle so the clouds can be
+# redrawn with other settings without counting the comments again.
+
+# USAGE:
+'''
+python src/visualization/word_clouds.py \
+--input_csv data/interim/train_2018-qualitative-data.csv \
+--output_dir reports/figures/word_clouds \
+--frequencies_pk data/interim/theme_word_frequencies.pickle \
+--n_jobs 4
+'''
+
+# Import Modules
+import sys
+sys.path.insert(1, '.')
+import os
+import re
+import pickle
+import argparse
+import matplotlib
+matplotlib.use('Agg')
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+from wordcloud import WordCloud, STOPWORDS
+from src.data.EDA_text import document_term_matrix, theme_word_frequency
+
+# Default File paths:
+filepath_in = './data/interim/train_2018-qualitative-data.csv'
+dirpath_out = './reports/figures/word_clouds'
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Render a word cloud for '
+                                     'every theme and subtheme')
+
+    parser.add_argument('--input_csv', '-i', type=str, dest='input_csv',
+                        action='store', default=filepath_in,
+                        help='the input csv file with coded comments')
+
+    parser.add_argument('--output_dir', '-o', type=str, dest='output_dir',
+                        action='store', default=dirpath_out,
+                        help='the directory to write the png files to')
+
+    parser.add_argument('--frequencies_pk', '-f', type=str,
+                        dest='frequencies_pk', action='store', default=None,
+                        help='optional pickle of the word frequencies, read '
+                        'if it exists and written otherwise')
+
+    parser.add_argument('--max_words', '-m', type=int, dest='max_words',
+                        action='store', default=50,
+                        help='number of words in each cloud')
+
+    parser.add_argument('--n_jobs', '-j', type=int, dest='n_jobs',
+                        action='store', default=1,
+                        help='number of processes drawing the clouds')
+
+    args = parser.parse_args()
+    return args
+
+
+def get_label_columns(df):
+    '''Returns the 12 theme and 62 subtheme columns of a coded comment csv,
+    which follow the USERID, comment and five code columns'''
+
+    return list(df.columns[7:19]), list(df.columns[19:])
+
+
+def get_word_frequencies(df, max_words=50, min_df=1):
+    '''Count the words of every theme and subtheme from one document-term
+    matrix
+
+    Parameters
+    ----------
+    df : dataframe of coded comments
+    max_words : int
+        The number of most frequent words kept for each label
+
+    Returns
+    -------
+    frequencies : dict with a {word: count} dict for each label
+    '''
+    themes, subthemes = get_label_columns(df)
+    comments = df.iloc[:, 1].fillna('')
+
+    stop_words = sorted(ENGLISH_STOP_WORDS.union(STOPWORDS))
+    term_doc_matrix, words = document_term_matrix(comments, min_df,
+                                                  stop_words=stop_words)
+    word_freqs = theme_word_frequency(term_doc_matrix, words,
+                                      df[themes + subthemes], max_words)
+
+    return {label: dict(zip(word_freq.words, word_freq.counts.tolist()))
+            for label, word_freq in word_freqs.items()}
+
+
+def render_word_cloud(filepath, frequencies, width=800, height=800,
+                      background_color='white', min_font_size=10):
+    '''Draw a word cloud from a {word: count} dict and save it as a png'''
+
+    wordcloud = WordCloud(width=width,
+                          height=height,
+                          background_color=background_color,
+                          min_font_size=min_font_size,
+                          max_words=len(frequencies))
+    wordcloud.generate_from_frequencies(frequencies).to_file(filepath)
+
+    return filepath
+
+
+def render_word_clouds(frequencies, output_dir, n_jobs=1):
+    '''Draw the word cloud of every label in a pool of processes
+
+    Returns
+    -------
+    filepaths : list of the png files written
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+
+    labels = [label for label in frequencies if frequencies[label]]
+    filepaths = [os.path.join(output_dir, re.sub(r'\W+', '_', label) +
+                              '.png') for label in labels]
+    frequencies = [frequencies[label] for label in labels]
+
+    if n_jobs == 1:
+        return list(map(render_word_cloud, filepaths, frequencies))
+
+    with ProcessPoolExecutor(n_jobs) as executor:
+        return list(executor.map(render_word_cloud, filepaths, frequencies))
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    args = get_arguments()
+
+    if args.frequencies_pk is not None and \
+            os.path.exists(args.frequencies_pk):
+        with open(args.frequencies_pk, 'rb') as handle:
+            frequencies = pickle.load(handle)
+    else:
+        df = pd.read_csv(args.input_csv)
+        frequencies = get_word_frequencies(df, args.max_words)
+
+        if args.frequencies_pk is not None:
+            with open(args.frequencies_pk, 'wb') as handle:
+                pickle.dump(frequencies, handle)
+
+    filepaths = render_word_clouds(frequencies, args.output_dir, args.n_jobs)
+    print('Wrote', len(filepaths), 'word clouds to', args.output_dir)
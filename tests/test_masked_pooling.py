@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('keras')
+
+from src.features.ragged_sequences import to_ragged, predict_sequences
+from src.models.biGRU import build_biGRU
+from src.models.conv1d import build_conv1d
+
+comments = [[5, 8, 2, 9], [7], [], [3, 4, 4, 1, 6, 2, 8, 9, 10, 11, 5, 3]]
+
+
+@pytest.mark.parametrize('build', [build_biGRU, build_conv1d])
+def test_prediction_does_not_depend_on_the_batch(build):
+    embed_matrix = np.random.RandomState(2019).normal(
+        size=(12, 300)).astype('float32')
+    embed_matrix[0] = 0
+    model = build(embed_matrix, maxlen=None)
+
+    # Predicted together every comment is padded to the longest comment
+    Y_batch = predict_sequences(model, to_ragged(comments))
+
+    for i, comment in enumerate(comments):
+        Y_alone = predict_sequences(model, to_ragged([comment]))
+        np.testing.assert_allclose(Y_alone[0], Y_batch[i], rtol=1e-5,
+                                   atol=1e-6)
@@ -0,0 +1,48 @@
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip('keras')
+
+from src.models.conv1d import build_conv1d
+from src.models.packed_models import pack_model, load_packed_model
+from src.models.packed_models import is_packed_model, save_packed_model
+
+
+def get_model():
+    embed_matrix = np.random.RandomState(2019).normal(
+        size=(20, 300)).astype('float32')
+    return build_conv1d(embed_matrix, maxlen=10)
+
+
+def test_pack_model_in_place(tmp_path):
+    model = get_model()
+    filepath = str(tmp_path / 'conv1d.h5')
+    model.save(filepath)
+
+    pack_model(filepath, str(tmp_path / 'embeddings'))
+
+    assert is_packed_model(filepath)
+    assert sorted(os.listdir(str(tmp_path))) == ['conv1d.h5', 'embeddings']
+    X = np.random.RandomState(0).randint(0, 20, (4, 10))
+    np.testing.assert_allclose(load_packed_model(filepath).predict(X),
+                               model.predict(X), rtol=1e-5)
+
+
+def test_failed_pack_keeps_the_model(tmp_path, monkeypatch):
+    model = get_model()
+    filepath = str(tmp_path / 'conv1d.h5')
+    model.save(filepath)
+    with open(filepath, 'rb') as handle:
+        saved = handle.read()
+
+    def fail():
+        raise RuntimeError('interrupted')
+
+    monkeypatch.setattr(model, 'to_json', fail)
+    with pytest.raises(RuntimeError):
+        save_packed_model(model, filepath, str(tmp_path / 'embeddings'))
+
+    with open(filepath, 'rb') as handle:
+        assert handle.read() == saved
+    assert not os.path.exists(filepath + '.tmp')
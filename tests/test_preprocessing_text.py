@@ -0,0 +1,37 @@
+import numpy as np
+
+from src.data.preprocessing_text import balanced_batches
+from src.data.preprocessing_text import balanced_steps_per_epoch
+
+# The third label has no comments, like some of the 62 subthemes
+Y = np.array([[1, 0, 0], [1, 0, 0], [1, 1, 0], [1, 0, 0], [0, 1, 0],
+              [1, 0, 0], [0, 0, 0]])
+X = np.arange(len(Y) * 4).reshape(len(Y), 4)
+
+
+def test_balanced_batches_with_the_default_random_state():
+    batches = balanced_batches(X, Y, batch_size=3)
+
+    X_epoch, Y_epoch = [], []
+    for _ in range(balanced_steps_per_epoch(Y, batch_size=3)):
+        X_batch, Y_batch = next(batches)
+        assert len(X_batch) <= 3
+        X_epoch.append(X_batch)
+        Y_epoch.append(Y_batch)
+    X_epoch, Y_epoch = np.vstack(X_epoch), np.vstack(Y_epoch)
+
+    # Every row is drawn at least once with its own labels, and the second
+    # label is oversampled to the 5 comments of the first
+    rows = X_epoch[:, 0] // 4
+    np.testing.assert_array_equal(Y_epoch, Y[rows])
+    assert set(rows) == set(range(len(Y)))
+    assert len(rows) == len(Y) + 3
+    assert Y_epoch[:, 1].sum() == 5
+    assert Y_epoch[:, 2].sum() == 0
+
+
+def test_balanced_batches_are_repeatable_with_a_seed():
+    first = next(balanced_batches(X, Y, batch_size=4, random_state=3))
+    second = next(balanced_batches(X, Y, batch_size=4, random_state=3))
+
+    np.testing.assert_array_equal(first[0], second[0])
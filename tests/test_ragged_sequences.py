@@ -0,0 +1,30 @@
+import numpy as np
+
+from src.features.ragged_sequences import to_ragged, bucketed_batches
+from src.features.ragged_sequences import bucketed_steps_per_epoch
+
+comments = [[5, 8, 2, 9], [7], [], [3, 4, 4, 1, 6], [2, 2], [9, 1, 3]]
+Y = np.arange(len(comments) * 2).reshape(-1, 2)
+
+
+def test_bucketed_batches_with_the_default_random_state():
+    X = to_ragged(comments)
+    batches = bucketed_batches(X, Y, batch_size=2)
+
+    drawn = []
+    for _ in range(bucketed_steps_per_epoch(X, batch_size=2)):
+        X_batch, Y_batch = next(batches)
+        # Every batch keeps at least 2 zeros in front of its longest comment
+        assert np.all(X_batch[:, :2] == 0)
+        drawn.extend(Y_batch[:, 0] // 2)
+
+    assert sorted(drawn) == list(range(len(comments)))
+
+
+def test_bucketed_batches_are_repeatable_with_a_seed():
+    X = to_ragged(comments)
+    first = next(bucketed_batches(X, Y, batch_size=2, random_state=7))
+    second = next(bucketed_batches(X, Y, batch_size=2, random_state=7))
+
+    np.testing.assert_array_equal(first[0], second[0])
+    np.testing.assert_array_equal(first[1], second[1])
@@ -0,0 +1,107 @@
+import datetime
+import pytest
+
+pytest.importorskip('spacy')
+openpyxl = pytest.importorskip('openpyxl')
+
+from src.data import sensitive_text
+
+
+def write_xlsx(filepath):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['title'])
+    sheet.append(['USERID', 'comment', 'code', 'score', 'date', 'datetime',
+                  'text', None, 'code'])
+    for i in range(40):
+        row = [1000 + i, 'comment %d' % i if i % 7 else None, 1,
+               1.5 if i == 30 else 2, datetime.datetime(2018, 1, 1 + i % 20),
+               datetime.datetime(2018, 1, 2, 10 if i == 33 else 0),
+               'abc' if i == 30 else '0123', None, 7]
+        if i == 5:
+            row = row[:3]
+        sheet.append(row)
+    sheet.append([])
+    sheet.append([2000, 'last comment', 1])
+    sheet.append([])
+    workbook.save(filepath)
+
+
+@pytest.mark.parametrize('chunksize', [1, 3, 7, 1000])
+def test_chunked_csv_matches_read_excel(tmp_path, monkeypatch, chunksize):
+    monkeypatch.setattr(sensitive_text, 'find_sensitive_text',
+                        lambda comments, *args: [
+                            i for i, comment in enumerate(comments)
+                            if '7' in str(comment)])
+    filepath = str(tmp_path / 'comments.xlsx')
+    write_xlsx(filepath)
+
+    full_csv = str(tmp_path / 'full.csv')
+    sensitive_text.remove_sensitive_text(filepath, 1).to_csv(full_csv,
+                                                             index=False)
+    chunked_csv = str(tmp_path / 'chunked.csv')
+    sensitive_text.remove_sensitive_text_chunked(filepath, 1, chunked_csv,
+                                                 chunksize)
+
+    with open(full_csv, 'rb') as full, open(chunked_csv, 'rb') as chunked:
+        assert full.read() == chunked.read()
+
+
+def interrupt_after(monkeypatch, n_chunks):
+    calls = []
+
+    def find_sensitive_text(comments, *args):
+        calls.append(1)
+        if len(calls) > n_chunks:
+            raise KeyboardInterrupt
+        return [i for i, comment in enumerate(comments)
+                if '7' in str(comment)]
+
+    monkeypatch.setattr(sensitive_text, 'find_sensitive_text',
+                        find_sensitive_text)
+
+
+def test_resume_reuses_the_checkpointed_plan(tmp_path, monkeypatch):
+    filepath = str(tmp_path / 'comments.xlsx')
+    write_xlsx(filepath)
+    full_csv = str(tmp_path / 'full.csv')
+    interrupt_after(monkeypatch, 100)
+    sensitive_text.remove_sensitive_text(filepath, 1).to_csv(full_csv,
+                                                             index=False)
+
+    chunked_csv = str(tmp_path / 'chunked.csv')
+    interrupt_after(monkeypatch, 2)
+    with pytest.raises(KeyboardInterrupt):
+        sensitive_text.remove_sensitive_text_chunked(filepath, 1, chunked_csv,
+                                                     7)
+
+    def get_excel_plan(*args):
+        raise AssertionError('the sheet was planned again')
+
+    monkeypatch.setattr(sensitive_text, 'get_excel_plan', get_excel_plan)
+    interrupt_after(monkeypatch, 100)
+    sensitive_text.remove_sensitive_text_chunked(filepath, 1, chunked_csv, 7)
+
+    with open(full_csv, 'rb') as full, open(chunked_csv, 'rb') as chunked:
+        assert full.read() == chunked.read()
+
+
+def test_resume_refuses_a_changed_chunksize_or_workbook(tmp_path,
+                                                        monkeypatch):
+    filepath = str(tmp_path / 'comments.xlsx')
+    write_xlsx(filepath)
+    chunked_csv = str(tmp_path / 'chunked.csv')
+    interrupt_after(monkeypatch, 2)
+    with pytest.raises(KeyboardInterrupt):
+        sensitive_text.remove_sensitive_text_chunked(filepath, 1, chunked_csv,
+                                                     7)
+
+    with pytest.raises(ValueError, match='chunksize'):
+        sensitive_text.remove_sensitive_text_chunked(filepath, 1, chunked_csv,
+                                                     5)
+
+    with open(filepath, 'ab') as handle:
+        handle.write(b'\0')
+    with pytest.raises(ValueError, match='changed'):
+        sensitive_text.remove_sensitive_text_chunked(filepath, 1, chunked_csv,
+                                                     7)
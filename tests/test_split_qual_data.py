@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+from src.data.split_qual_data import get_test_mask, hash_split
+
+
+def test_user_id_split_does_not_depend_on_chunk_dtype(tmp_path):
+    # The second chunk has a missing USERID, which pandas would read as
+    # floats, so 1036 would be written as 1036.0 in that chunk
+    user_ids = list(range(1000, 1040)) + [None] + list(range(1000, 1040))
+    df = pd.DataFrame({'USERID': pd.array(user_ids, dtype='Int64'),
+                       'comment': ['comment %d' % i
+                                   for i in range(len(user_ids))]})
+    input_csv = tmp_path / 'comments.csv'
+    df.to_csv(input_csv, index=False)
+
+    hash_split(input_csv, tmp_path / 'test.csv', tmp_path / 'train.csv',
+               test_frac=0.5, chunksize=40)
+    df_test = pd.read_csv(tmp_path / 'test.csv', dtype={0: str})
+    df_train = pd.read_csv(tmp_path / 'train.csv', dtype={0: str})
+
+    # Each USERID is in one split only, and appears twice in it
+    assert not set(df_test.USERID) & set(df_train.USERID.dropna())
+    assert (df_test.USERID.value_counts() == 2).all()
+    assert df_train.USERID.isna().sum() == 1
+    assert len(df_test) + len(df_train) == len(df)
+
+
+def test_user_id_mask_ignores_float_formatting():
+    mask_int = get_test_mask(pd.Series(['1036', '2', '77']), test_frac=0.5)
+    mask_float = get_test_mask(pd.Series([1036.0, 2.0, '77.0']),
+                               test_frac=0.5)
+
+    assert (mask_int == mask_float).all()
+    assert not get_test_mask(pd.Series([np.nan, None, '']),
+                             test_frac=1.0).any()